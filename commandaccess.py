@@ -1,91 +1,120 @@
-import collections
-from shellbase import BaseCommand, gShellCommands
-import string
+import importlib
+from shellbase import BaseCommand, gShellCommands, PrefixIndex
 import sys
 
-from prompt_toolkit import HTML
-
 import helptext
 import shellhelp
-import iscmds
-import shellcmds 
+
+# The command table is the only place commands need to be listed. It holds everything needed to
+# list and look up commands -- name, module, class, aliases, and description -- so the modules
+# which implement them are not imported and the commands are not created until first use.
+# Importing iscmds pulls in much of pymensago, so this makes a big difference at startup. The
+# entries must match the commands themselves. test_base.test_command_table checks this.
+_command_table = {
+	'chdir':		('shellcmds', 'CommandChDir', [ 'cd' ], 'change directory/location'),
+	'connections':	('shellcmds', 'CommandConnections', [], 'List open server connections'),
+	'exit':			('shellcmds', 'CommandExit', [ 'x', 'q' ], 'Exits the shell'),
+	'help':			('shellcmds', 'CommandHelp', [ '?' ], 'Show help on a command'),
+	'jobs':			('shellcmds', 'CommandJobs', [], 'List background jobs'),
+	'ls':			('shellcmds', 'CommandListDir', [ 'dir' ], 'list directory contents'),
+	'profile':		('shellcmds', 'CommandProfile', [], 'Manage profiles.'),
+	'resetdb':		('shellcmds', 'CommandResetDB', [],
+						'DEVELOPER: Completely resets the local Mensago database'),
+	'shell':		('shellcmds', 'CommandShell', [ 'sh', '`' ], 'Run a shell command'),
+
+	'login':		('iscmds', 'CommandLogin', [], 'Logs into the specified server'),
+	'logout':		('iscmds', 'CommandLogout', [],
+						'Logs out of the currently-connected server'),
+	'myinfo':		('iscmds', 'CommandMyInfo', [], 'Set workspace contact information'),
+	'preregister':	('iscmds', 'CommandPreregister', [],
+						'Preregister a new account for someone.'),
+	'regcode':		('iscmds', 'CommandRegCode', [],
+						'Finish registration of an account with a registration code'),
+	'register':		('iscmds', 'CommandRegister', [],
+						'Register a new account on the connected server.'),
+}
 
 __aliases = dict()
-__all_names = list()
+__all_names = PrefixIndex()
 
 def init_commands():
-	add_command(shellcmds.CommandChDir())
-	add_command(shellcmds.CommandListDir())
-	add_command(shellcmds.CommandExit())
-	add_command(shellcmds.CommandHelp())
-	add_command(shellcmds.CommandShell())
-	add_command(shellcmds.CommandProfile())
-	add_command(shellcmds.CommandResetDB())
-
-	add_command(iscmds.CommandLogin())
-	add_command(iscmds.CommandLogout())
-	add_command(iscmds.CommandPreregister())
-	add_command(iscmds.CommandRegCode())
-	add_command(iscmds.CommandRegister())
-
-	add_command(iscmds.CommandMyInfo())
-	
 	global __all_names
-	__all_names.sort()
+	__aliases.clear()
+
+	names = list()
+	for name, entry in _command_table.items():
+		names.append(name)
+		for alias in entry[2]:
+			if alias in __aliases:
+				print(f"Error duplicate alias {alias}. Already exists for {__aliases[alias]}")
+				sys.exit(0)
+			__aliases[alias] = name
+			names.append(alias)
+
+	__all_names = PrefixIndex(names)
 
 	# Create the help topic for the command list
-	ordered = collections.OrderedDict(sorted(gShellCommands.items()))
+	maxlength = max([len(name) for name in _command_table])
 	parts = list()
-
-	maxlength = 0
-	for name,_ in ordered.items():
-		if len(name) > maxlength:
-			maxlength = len(name)
-	
-	for name,item in ordered.items():
-		parts.append(f"<gray><b>{name.rjust(maxlength)}</b>  {item.description}</gray>")
+	for name in sorted(_command_table.keys()):
+		parts.append(f"<gray><b>{name.rjust(maxlength)}</b>  {_command_table[name][3]}</gray>")
 	shellhelp.addtopic('commands', '\n'.join(parts), None)
 
 	shellhelp.addtopic('myinfo_fields', helptext.myinfo_fields, None)
 	shellhelp.addtopic('myinfo_fields2', helptext.myinfo_fields2, None)
 	shellhelp.addtopic('myinfo_fields3', helptext.myinfo_fields3, None)
-	
+
 
 def add_command(cmd: BaseCommand):
-	'''Add a Command instance to the list'''
+	'''Add a Command to the list. Commands added this way are available immediately and don't need
+	an entry in the command table.'''
 
 	global __all_names, __aliases
 
-	shellcmds.gShellCommands[cmd.name] = cmd
-	__all_names.append(cmd.name)
-	
+	gShellCommands[cmd.name] = type(cmd)
+	__all_names.add(cmd.name)
+
 	for k,v in cmd.get_aliases().items():
 		if k in __aliases:
 			print(f"Error duplicate alias {k}. Already exists for {__aliases[k]}")
 			sys.exit(0)
 		__aliases[k] = v
-		__all_names.append(k)
+		__all_names.add(k)
 
 
 def get_command(name: str):
-	'''Retrives a Command instance for the specified name, including alias resolution.'''
+	'''Retrives a Command instance for the specified name, including alias resolution. Each call
+	returns a new instance for a single invocation of the command. The command's module is
+	imported the first time it is requested.'''
 
 	global __aliases
 
 	if len(name) < 1:
-		return shellcmds.CommandEmpty()
+		return importlib.import_module('shellcmds').CommandEmpty()
 
 	if name in __aliases:
 		name = __aliases[name]
 
-	if name in shellcmds.gShellCommands:
-		return shellcmds.gShellCommands[name]
+	if name in gShellCommands:
+		return gShellCommands[name]()
 
-	return shellcmds.CommandUnrecognized()
+	if name in _command_table:
+		modname, classname, _, _ = _command_table[name]
+		gShellCommands[name] = getattr(importlib.import_module(modname), classname)
+		return gShellCommands[name]()
+
+	return importlib.import_module('shellcmds').CommandUnrecognized()
 
 
 def get_command_names():
 	'''Get the names of all available commands'''
-	
+
+	global __all_names
+	return __all_names.words
+
+
+def get_command_completions(prefix: str) -> list:
+	'''Get the names and aliases of all commands which start with the prefix'''
+
 	global __all_names
-	return __all_names
+	return __all_names.matches(prefix)
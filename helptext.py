@@ -1,6 +1,28 @@
 '''This module merely stores the extensive help text for different commands to 
 ensure the code remains easy to read.'''
 
+connections_cmd = '''Usage: connections [close]
+
+Lists the server connections the shell is keeping open. A connection to a 
+domain is kept after a command is done with it so that later commands for the 
+same domain can use it without connecting again. Connections which are not 
+used for five minutes are closed. `connections close` closes all of them once 
+any jobs using them have finished.
+'''
+
+jobs_cmd = '''Usage: jobs
+
+Lists background jobs. Commands which wait on a server, such as login, 
+preregister, and regcode, run in the background so that other commands can be 
+used in the meantime. Each is given a job number which is printed when it 
+starts and again with its results when it finishes. Finished jobs are removed 
+from the list once they have been shown by this command.
+
+Jobs for the same server run one after another in the order they were 
+entered. Jobs for different servers run at the same time. logout and 
+preregister go to the server of the most recent job.
+'''
+
 login_cmd = '''Usage: login [address]
 
 Log into a server. The address used may be the regular Mensago 
@@ -23,6 +45,8 @@ error if not connected.
 '''
 
 myinfo_cmd = '''Usage: myinfo <verb> <fieldname> <value>
+       myinfo import <file>
+       myinfo export [<file>]
 
 Sets contact information for the profile. Available information which can be 
 set is listed below:
@@ -44,6 +68,18 @@ changes fields. `check` takes no arguments; it merely checks to make sure that
 all personal information fields are valid and that no required fields are
 missing. Values which have spaces must be enclosed by double-quotes (").
 
+`check all` checks every profile instead of just the active one and shows the
+number of problems found in each. It takes two optional arguments:
+`jobs=<number>` sets how many profiles are checked at once, and
+`report=<file>` saves the results as CSV.
+
+`import <file>` adds the contact information in a JSON or vCard (.vcf) file.
+Each field in the file, such as Phone or Nicknames, replaces that field as a
+whole. Fields which aren't in the file are kept. The result is checked as
+`check` would before anything is changed, and the fields are then written all
+at once. `export [file]` writes the contact information as JSON to the file
+or, if none is given, the screen.
+
 Detailed information fields can be found in the `myinfo_fields` topic.
 '''
 
@@ -139,6 +175,7 @@ Custom - A dictionary of string fields.
 '''
 
 preregister_cmd='''Usage: preregister user_id [domain]
+       preregister from=<file> [out=<file>] [jobs=<number>]
 
 Preprovisions a workspace for a user. This command only works when logged in 
 as the administrator. The user ID parameter is required, but it may be given 
@@ -147,6 +184,17 @@ workspace ID is acceptable. The domain may also be specified. If not specified
 the default domain for the organization is used. The command returns a
 workspace ID and a preregistration code. The user will perform the initial
 login with either the workspace ID or the user ID and the registration code.
+
+`from=<file>` preregisters every account listed in a CSV file. The file needs 
+a header row with a `uid` column and may also have a `domain` column; a uid 
+which is empty or `none` gets only a workspace ID. The whole file is checked 
+before any accounts are created. The requests are sent one after another over 
+the current connection in a single background job. With `jobs=<number>`, that 
+many extra connections are each logged in as the administrator and send 
+requests at the same time. The user ID, workspace ID, domain, and registration 
+code of each account are shown or, if `out=<file>` is given, written to the 
+file as they arrive, in the order of the input file -- as JSON lines if its 
+name ends in .jsonl and CSV otherwise.
 '''
 
 profile_cmd = '''Usage: profile <action> <profilename>
@@ -1,5 +1,13 @@
 '''Contains the implementations for shell commands'''
+from concurrent.futures import Future, ThreadPoolExecutor
+import csv
 from getpass import getpass
+import json
+import os
+import queue
+import re
+import sqlite3
+from urllib.request import pathname2url
 
 from retval import ErrExists, RetVal, ErrBadData, ErrBadValue, ErrOK, ErrServerError
 
@@ -10,15 +18,14 @@ from pymensago.encryption import check_password_complexity
 from pymensago.utils import MAddress, UserID, Domain
 
 import helptext
-from shellbase import BaseCommand, ShellState
+from shellbase import BaseCommand, PrefixIndex, ShellState, get_filespec_completions
 
 class CommandLogin(BaseCommand):
 	'''Logs into the specified server'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'login'
-		self.help = helptext.login_cmd
-		self.description = 'Logs into the specified server'
+	__slots__ = ()
+	name = 'login'
+	help = helptext.login_cmd
+	description = 'Logs into the specified server'
 
 	def validate(self, shellstate: ShellState) -> RetVal:
 		if len(self.tokens) > 1:
@@ -35,6 +42,18 @@ class CommandLogin(BaseCommand):
 		
 		return RetVal()
 		
+	def is_background(self) -> bool:
+		return True
+
+	def job_domain(self, shellstate: ShellState) -> str:
+		if len(self.tokens) == 1:
+			return MAddress(self.tokens[0]).domain.as_string()
+		
+		status = shellstate.client.pman.get_active_profile()
+		if status.error():
+			return ''
+		return status['profile'].domain.as_string()
+
 	def execute(self, shellstate: ShellState) -> RetVal:
 		addr = MAddress()
 		if len(self.tokens) == 0:
@@ -53,23 +72,28 @@ class CommandLogin(BaseCommand):
 
 class CommandLogout(BaseCommand):
 	'''Logs out of the currently-connected server'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'logout'
-		self.help = helptext.logout_cmd
-		self.description = 'Logs out of the currently-connected server'
+	__slots__ = ()
+	name = 'logout'
+	help = helptext.logout_cmd
+	description = 'Logs out of the currently-connected server'
 		
+	def is_background(self) -> bool:
+		return True
+
+	def finish(self, shellstate: ShellState, domain: str, status: RetVal):
+		# Close the logged-out connection so that a later login doesn't reuse the session
+		shellstate.pool.evict(domain)
+
 	def execute(self, shellstate: ShellState) -> RetVal:
 		return shellstate.client.logout()
 
 
 class CommandMyInfo(BaseCommand):
 	'''Manipulate workspace information'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'myinfo'
-		self.help = helptext.myinfo_cmd
-		self.description = 'Set workspace contact information'
+	__slots__ = ()
+	name = 'myinfo'
+	help = helptext.myinfo_cmd
+	description = 'Set workspace contact information'
 
 	def validate(self, shellstate: ShellState) -> RetVal:
 		if len(self.tokens) > 3:
@@ -77,8 +101,9 @@ class CommandMyInfo(BaseCommand):
 		
 		if len(self.tokens):
 			verb = self.tokens[0].casefold()
-			if verb not in [ 'set', 'del', 'check', 'get' ]:
-				return RetVal(ErrBadValue, "Verb must be 'set', 'get', 'del', 'check'")
+			if verb not in [ 'set', 'del', 'check', 'get', 'import', 'export' ]:
+				return RetVal(ErrBadValue,
+					"Verb must be 'set', 'get', 'del', 'check', 'import', or 'export'")
 		else:
 			verb = 'get'
 		self.args['verb'] = verb
@@ -109,8 +134,17 @@ class CommandMyInfo(BaseCommand):
 			self.args['field'] = field
 		
 		elif verb == 'check':
-			# 'check'
-			if len(self.tokens) != 1:
+			# 'check' or 'check all'
+			if len(self.tokens) == 2 and self.tokens[1].casefold() == 'all':
+				self.args['all'] = True
+				try:
+					jobs = int(self.args.get('jobs', '8'))
+				except ValueError:
+					jobs = 0
+				if jobs < 1:
+					return RetVal(ErrBadValue, 'jobs must be a positive number')
+				self.args['jobs'] = jobs
+			elif len(self.tokens) != 1:
 				return RetVal(ErrBadData, self.help)
 		
 		elif verb == 'get':
@@ -118,15 +152,51 @@ class CommandMyInfo(BaseCommand):
 				self.args['field'] = self.tokens[1]
 			else:
 				self.args['field'] = '*'
+		
+		elif verb == 'import':
+			if len(self.tokens) != 2:
+				return RetVal(ErrBadData, self.help)
+			
+			# The whole file is loaded and checked here so that nothing is written unless all of
+			# it is valid
+			status = _load_contact_file(self.tokens[1])
+			if status.error():
+				return status
+			
+			fields = status['fields']
+			status = shellstate.client.pman.get_active_profile()
+			if status.error():
+				return status
+			status = load_user_field(status['profile'].db, '*')
+			existing = dict() if status.error() else dict(zip(status['name'], status['value']))
+			
+			status = check_contact_fields(_merge_fields(existing, fields))
+			if status.error():
+				if status.has_value('errors'):
+					return _format_check_errors(status['errors'])
+				return status
+			self.args['fields'] = fields
+		
+		elif verb == 'export':
+			if len(self.tokens) > 2:
+				return RetVal(ErrBadData, self.help)
+			self.args['path'] = self.tokens[1] if len(self.tokens) == 2 else ''
 
 		return RetVal()
 
 	def execute(self, shellstate: ShellState) -> RetVal:
 
+		if self.args['verb'] == 'check' and 'all' in self.args:
+			return _check_all_profiles(shellstate.client.pman.get_profiles(), self.args['jobs'],
+				self.args.get('report', ''))
+
 		status = shellstate.client.pman.get_active_profile()
 		if not status.error():
 			profile = status['profile']
 		
+		if self.args['verb'] in [ 'set', 'del', 'import' ]:
+			shellstate.field_slots.pop(profile.name, None)
+		
 		if self.args['verb'] == 'set':
 			return save_user_field(profile.db, self.args['field'], self.args['value'])
 		elif self.args['verb'] == 'del':
@@ -145,36 +215,62 @@ class CommandMyInfo(BaseCommand):
 			return status.set_info(status['value'])
 			
 		elif self.args['verb'] == 'check':
-			status = _check_myinfo(shellstate)
+			status = check_contact_db(profile.db)
 			if status.error():
-				out = list()
-				outstatus = RetVal(ErrBadData)
-				if 'invalid' in status['errors']:
-					out.append('The following fields were invalid:')
-					out.extend(status['errors']['invalid'])
-					outstatus.set_value('invalid', status['errors']['invalid'])
-				
-				if 'missing' in status['errors']:
-					out.append('\nThe following field components were missing:')
-					out.extend(status['errors']['missing'])
-					outstatus.set_value('missing', status['errors']['missing'])
-				
-				outstatus.set_info('\n'.join(out))
-				return outstatus 
+				if status.has_value('errors'):
+					return _format_check_errors(status['errors'])
+				return status
 			return RetVal(ErrOK, 'User contact info is compliant')
+		
+		elif self.args['verb'] == 'import':
+			return _import_fields(profile.db, self.args['fields'])
+		
+		elif self.args['verb'] == 'export':
+			return _export_fields(profile.db, self.args['path'])
 
 		return load_user_field(profile.db, '*')
 
+	def autocomplete(self, tokens: list, shellstate: ShellState):
+		if len(tokens) == 1:
+			return [ [verb, verb] for verb in _myinfo_verbs.matches(tokens[0].casefold()) ]
+		
+		if len(tokens) == 2 and tokens[0].casefold() in [ 'set', 'get', 'del' ]:
+			slots = _get_field_slots(shellstate)
+			return [ [field, field] for field in _get_field_completions(tokens[1], slots) ]
+		
+		if len(tokens) == 2 and tokens[0].casefold() in [ 'import', 'export' ]:
+			return get_filespec_completions(tokens[1])
+		
+		return list()
+
 
 class CommandPreregister(BaseCommand):
 	'''Preregister an account for someone'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'preregister'
-		self.help = helptext.preregister_cmd
-		self.description = 'Preregister a new account for someone.'
+	__slots__ = ()
+	name = 'preregister'
+	help = helptext.preregister_cmd
+	description = 'Preregister a new account for someone.'
 		
 	def validate(self, shellstate: ShellState) -> RetVal:
+		if 'from' in self.args:
+			if self.tokens:
+				return RetVal(ErrBadData, self.help)
+			
+			try:
+				jobs = int(self.args.get('jobs', '1'))
+			except ValueError:
+				jobs = 0
+			if jobs < 1:
+				return RetVal(ErrBadValue, 'jobs must be a positive number')
+			self.args['jobs'] = jobs
+
+			# As with `myinfo import`, the whole file is checked before anything is sent
+			status = _load_prereg_file(self.args['from'])
+			if status.error():
+				return status
+			self.args['accounts'] = status['accounts']
+			return RetVal()
+		
 		if len(self.tokens) not in [1,2]:
 			return RetVal(ErrBadData, self.help)
 		
@@ -190,7 +286,13 @@ class CommandPreregister(BaseCommand):
 
 		return RetVal()
 	
+	def is_background(self) -> bool:
+		return True
+
 	def execute(self, shellstate: ShellState) -> RetVal:
+		if 'accounts' in self.args:
+			return _preregister_from_file(shellstate, self.args['accounts'],
+				self.args.get('out', ''), self.args['jobs'])
 		
 		uid = UserID()
 		if self.tokens[0].casefold() != 'none':
@@ -226,11 +328,10 @@ class CommandPreregister(BaseCommand):
 
 class CommandRegister(BaseCommand):
 	'''Register an account on a server'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'register'
-		self.help = helptext.register_cmd
-		self.description = 'Register a new account on the connected server.'
+	__slots__ = ()
+	name = 'register'
+	help = helptext.register_cmd
+	description = 'Register a new account on the connected server.'
 
 	def validate(self, shellstate: ShellState) -> RetVal:
 		if len(self.tokens) in [0, 1]:
@@ -253,6 +354,18 @@ class CommandRegister(BaseCommand):
 
 		return RetVal()
 
+	def is_background(self) -> bool:
+		# Without a password on the command line, the user is prompted for one
+		return 'password' in self.args
+
+	def job_domain(self, shellstate: ShellState) -> str:
+		return Domain(self.tokens[0]).as_string()
+
+	def finish(self, shellstate: ShellState, domain: str, status: RetVal):
+		# The job registered the profile using its own client, so the shell's copy is out of date
+		if not status.error():
+			shellstate.reset_client()
+
 	def execute(self, shellstate: ShellState) -> RetVal:
 		
 		if 'password' not in self.args:
@@ -315,11 +428,10 @@ class CommandRegister(BaseCommand):
 
 class CommandRegCode(BaseCommand):
 	'''Finish registration of an account with a registration code'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'regcode'
-		self.help = helptext.regcode_cmd
-		self.description = 'Finish registration of an account with a registration code'
+	__slots__ = ()
+	name = 'regcode'
+	help = helptext.regcode_cmd
+	description = 'Finish registration of an account with a registration code'
 	
 	def validate(self, shellstate: ShellState) -> RetVal:
 		if len(self.tokens) not in [2, 3]:
@@ -343,6 +455,18 @@ class CommandRegCode(BaseCommand):
 		
 		return RetVal()
 		
+	def is_background(self) -> bool:
+		# Without a password on the command line, the user is prompted for one
+		return 'password' in self.args
+
+	def job_domain(self, shellstate: ShellState) -> str:
+		return MAddress(self.tokens[0]).domain.as_string()
+
+	def finish(self, shellstate: ShellState, domain: str, status: RetVal):
+		# The job assigned the identity using its own client, so the shell's copy is out of date
+		if not status.error():
+			shellstate.reset_client()
+
 	def execute(self, shellstate: ShellState) -> RetVal:
 		if 'password' not in self.args:
 			pw = _setpassword_interactive()
@@ -447,85 +571,694 @@ _dictlist_fields = {
 }
 
 
+_myinfo_verbs = PrefixIndex([ 'set', 'get', 'del', 'check', 'import', 'export' ])
+
+# Every valid field specifier as a tuple of its field name, whether it has an item index, and its
+# subfield, e.g. `Phone.0.Label` -> ('Phone', True, 'Label'). Each maps to the name of the
+# dictionary list field the specifier belongs to, or an empty string for other fields.
+_field_rules = { (f, False, None): '' for f in _toplevel_fields }
+_field_rules.update({ (f, True, None): '' for f in _list_fields })
+_field_rules.update({ (name, True, sub): name for name, subfields in _dictlist_fields.items()
+	for sub in subfields })
+
+# The required subfields of each dictionary list field, in the order they are reported
+_required_subfields = { name: [ k for k, v in subfields.items() if v ]
+	for name, subfields in _dictlist_fields.items() }
+_dictlist_order = { name: i for i, name in enumerate(_dictlist_fields) }
+
+# Splits a field specifier into its Annotations. prefix, field name, item index, and subfield
+_field_pattern = re.compile(r'(Annotations\.)?([^.]+)(?:\.([0-9]+)(?:\.([^.]+))?)?')
+
+_index_pattern = re.compile(r'\.[0-9]+(?=\.|$)')
+
+# Indexes for completing field specifiers. List and dictionary list fields are completed up to the
+# dot which follows them.
+_field_names = PrefixIndex(_toplevel_fields + [ f + '.' for f in _list_fields ] +
+	[ f + '.' for f in _dictlist_fields ] + [ 'Annotations.' ])
+_subfield_names = { k: PrefixIndex(v.keys()) for k, v in _dictlist_fields.items() }
+
+def _get_field_slots(shellstate: ShellState) -> dict:
+	'''Returns a dictionary mapping each list and dictionary list field in the active profile,
+	including its Annotations. prefix if it has one, to a sorted list of the item indices in use.
+	This is called from the completion thread, so it never creates the client and it reads the
+	profile through a read-only database connection of its own. Results are cached in the shell
+	state by profile until the profile's fields change.'''
+	
+	client = shellstate.loaded_client
+	if client is None:
+		return dict()
+	
+	status = client.pman.get_active_profile()
+	if status.error():
+		return dict()
+	profile = status['profile']
+	slots = shellstate.field_slots.get(profile.name)
+	if slots is not None:
+		return slots
+
+	try:
+		db = _open_profile_db(profile)
+	except (OSError, sqlite3.Error):
+		return dict()
+	try:
+		status = load_user_field(db, '*')
+	finally:
+		db.close()
+	if status.error():
+		return dict()
+	
+	slots = dict()
+	for field in status['name']:
+		match = _index_pattern.search(field)
+		if match:
+			slots.setdefault(field[:match.start()], set()).add(int(match.group()[1:]))
+	slots = { k: sorted(v) for k, v in slots.items() }
+	shellstate.field_slots[profile.name] = slots
+	return slots
+
+
+def _get_field_completions(spec: str, slots=None) -> list:
+	'''Returns the field specifiers which could complete the partial one given. Item indices are
+	offered from those already in use, given in slots as returned by _get_field_slots(), plus the
+	next free one.'''
+
+	prefix = ''
+	if spec.startswith('Annotations.'):
+		prefix = 'Annotations.'
+		spec = spec[len(prefix):]
+	
+	parts = spec.split('.')
+	if len(parts) == 1:
+		return [ prefix + name for name in _field_names.matches(parts[0])
+			if not (prefix and name == 'Annotations.') ]
+	
+	if len(parts) == 2 and (parts[0] in _list_fields or parts[0] in _dictlist_fields):
+		used = slots.get(prefix + parts[0], list()) if slots else list()
+		indices = used + [ used[-1] + 1 if used else 0 ]
+		suffix = '.' if parts[0] in _dictlist_fields else ''
+		base = prefix + parts[0]
+		return [ f"{base}.{i}{suffix}" for i in indices if str(i).startswith(parts[1]) ]
+
+	if len(parts) == 3 and parts[0] in _subfield_names and parts[1].isdigit():
+		base = f"{prefix}{parts[0]}.{parts[1]}."
+		return [ base + name for name in _subfield_names[parts[0]].matches(parts[2]) ]
+	
+	return list()
+
+
 def _is_field_valid(fieldname: str) -> bool:
 	'''Validates the field name specifier passed to MyInfo. This function is very specific to the
 	Mensago contacts spec and will not permit fields outside the spec.'''
 
-	parts = fieldname.split('.')
+	match = _field_pattern.fullmatch(fieldname)
+	return bool(match) and (match[2], match[3] is not None, match[4]) in _field_rules
 
-	if parts[0] == 'Annotations':
-		parts = parts[1:]
 
-	if len(parts) == 1:
-		return parts[0] in _toplevel_fields
+def check_contact_fields(names) -> RetVal:
+	'''Checks the names of a contact's flattened fields for compliance with the contact spec in a
+	single pass. If there are problems, the RetVal's 'errors' field is a dictionary holding a list
+	of the 'invalid' fields and/or a list of the 'missing' required subfields.'''
+
+	invalid = list()
+
+	# The subfields found for each dictionary list item, keyed by field name and item index
+	items = dict()
+	for name in names:
+		match = _field_pattern.fullmatch(name)
+		rule = None
+		if match:
+			rule = _field_rules.get((match[2], match[3] is not None, match[4]))
+		
+		if rule is None:
+			invalid.append(name)
+		elif rule and not match[1]:
+			# Only the required subfields of the contact itself are checked, not annotations
+			items.setdefault((rule, int(match[3])), set()).add(match[4])
 	
-	if len(parts) == 2:
-		try:
-			_ = int(parts[1])
-		except:
-			return False
-		return parts[0] in _list_fields
+	missing = list()
+	for field, index in sorted(items, key=lambda x: (_dictlist_order[x[0]], x[1])):
+		present = items[(field, index)]
+		missing.extend([ f'{key} missing from {field} item' for key in _required_subfields[field]
+			if key not in present ])
+	
+	if not invalid and not missing:
+		return RetVal()
+	
+	errors = dict()
+	if invalid:
+		errors['invalid'] = invalid
+	if missing:
+		errors['missing'] = missing
+	return RetVal(ErrBadData).set_value('errors', errors)
+
+
+def check_contact_db(db) -> RetVal:
+	'''Checks the contact information in a profile database for compliance with the contact spec.
+	The return value is the same as check_contact_fields().'''
+
+	status = load_user_field(db, '*')
+	if status.error():
+		return status
+	
+	return check_contact_fields(status['name'])
+
+
+# The name of the database in each profile's folder which holds its contact information
+_profile_db_name = 'storage.db'
+
+def _open_profile_db(profile) -> sqlite3.Connection:
+	'''Opens a read-only connection to a profile's database. It is separate from the profile's own
+	connection, so it can be used from any thread.'''
+	dbpath = os.path.abspath(os.path.join(profile.path, _profile_db_name))
+	if not os.path.exists(dbpath):
+		raise FileNotFoundError('no profile database')
+	return sqlite3.connect(f"file:{pathname2url(dbpath)}?mode=ro", uri=True)
+
 
-	if len(parts) == 3:
+def check_profile(profile) -> dict:
+	'''Checks the contact information of a profile, active or not, for compliance. Returns a
+	dictionary with the profile's name and counts of its invalid fields and missing subfields. If
+	the profile couldn't be checked, the 'error' field explains why. The profile's database is
+	opened read-only, so this may be run in several threads at once.'''
+	out = { 'profile': profile.name, 'invalid': 0, 'missing': 0, 'error': '' }
+
+	try:
+		db = _open_profile_db(profile)
+	except Exception as e:
+		out['error'] = str(e)
+		return out
+	
+	try:
+		status = check_contact_db(db)
+	except Exception as e:
+		status = RetVal().wrap_exception(e)
+	finally:
+		db.close()
+
+	if status.has_value('errors'):
+		out['invalid'] = len(status['errors'].get('invalid', list()))
+		out['missing'] = len(status['errors'].get('missing', list()))
+	elif status.error():
+		out['error'] = f"{status.error()} {status.info()}".strip()
+	return out
+
+
+def check_profiles(profiles: list, jobs=8) -> list:
+	'''Checks the contact information of many profiles concurrently. Returns a list of the results
+	from check_profile() in the same order as the profiles.'''
+	with ThreadPoolExecutor(jobs) as pool:
+		return list(pool.map(check_profile, profiles))
+
+
+def _check_all_profiles(profiles: list, jobs: int, reportpath: str) -> RetVal:
+	'''Implements `myinfo check all`'''
+	results = check_profiles(profiles, jobs)
+
+	if reportpath:
 		try:
-			_ = int(parts[1])
-		except:
-			return False
+			with open(reportpath, 'w', newline='', encoding='utf8') as fhandle:
+				writer = csv.DictWriter(fhandle, fieldnames=[ 'profile', 'invalid', 'missing',
+					'error' ])
+				writer.writeheader()
+				writer.writerows(results)
+		except Exception as e:
+			return RetVal().wrap_exception(e)
+	
+	width = max([ len(r['profile']) for r in results ] + [ len('Profile') ])
+	out = [ f"{'Profile':<{width}}  Invalid  Missing" ]
+	problems = 0
+	for result in results:
+		if result['error']:
+			out.append(f"{result['profile']:<{width}}  {result['error']}")
+		else:
+			out.append(f"{result['profile']:<{width}}  {result['invalid']:>7}  "
+				f"{result['missing']:>7}")
+		if result['error'] or result['invalid'] or result['missing']:
+			problems += 1
+	
+	out.append(f"\n{len(results) - problems} of {len(results)} profiles are compliant")
+	if reportpath:
+		out.append(f"Report saved to {reportpath}")
+	
+	return RetVal(ErrBadData if problems else ErrOK, '\n'.join(out)).set_values({
+		'results': results
+	})
+
+
+def _load_prereg_file(path: str) -> RetVal:
+	'''Loads the accounts to preregister from a CSV file with a header row. The file must have a
+	`uid` column, which may be empty or `none` for an account with only a workspace ID, and may
+	have a `domain` column. The accounts are returned in the 'accounts' field as a list of
+	dictionaries with the keys uid and domain.'''
+	try:
+		with open(os.path.expanduser(path), 'r', newline='', encoding='utf8') as fhandle:
+			rows = list(csv.DictReader(fhandle))
+	except Exception as e:
+		return RetVal().wrap_exception(e)
+	
+	if not rows:
+		return RetVal(ErrBadData, f"No accounts found in {path}")
+	if 'uid' not in rows[0]:
+		return RetVal(ErrBadData, f"{path} has no uid column")
+
+	accounts = list()
+	errors = list()
+	seen = set()
+	for line, row in enumerate(rows, 2):
+		uid = UserID()
+		uidtext = (row['uid'] or '').strip()
+		if uidtext and uidtext.casefold() != 'none':
+			uid.set(uidtext)
+			if not uid.is_valid():
+				errors.append(f"line {line}: bad user ID {uidtext}")
+				continue
+			if uid.as_string() in seen:
+				errors.append(f"line {line}: duplicate user ID {uidtext}")
+				continue
+			seen.add(uid.as_string())
+		
+		domain = Domain()
+		domaintext = (row.get('domain') or '').strip()
+		if domaintext:
+			domain.set(domaintext)
+			if not domain.is_valid():
+				errors.append(f"line {line}: bad domain {domaintext}")
+				continue
 		
-		return parts[0] in _dictlist_fields and parts[2] in _dictlist_fields[parts[0]].keys()
+		accounts.append({ 'uid': uid, 'domain': domain })
+	
+	if errors:
+		out = [ f"{len(errors)} problems found in {path}:" ] + errors[:10]
+		if len(errors) > 10:
+			out.append(f"...and {len(errors) - 10} more")
+		return RetVal(ErrBadData, '\n'.join(out))
+	
+	return RetVal().set_value('accounts', accounts)
 
-	return False
 
+def _as_text(value) -> str:
+	'''Returns the string form of a value from pymensago, which may be an object or a string'''
+	if not value:
+		return ''
+	return value.as_string() if hasattr(value, 'as_string') else str(value)
 
-def _check_myinfo(shellstate: ShellState) -> RetVal:
-	'''This function performs a complete check of the userinfo stored in the database and confirms 
-	that it complies with the spec.'''
+
+def _preregister_one(client, account: dict) -> dict:
+	'''Preregisters one account from _load_prereg_file() and returns its result for
+	preregister_accounts()'''
+	status = client.preregister_account(account['uid'], account['domain'])
+	if status.error():
+		return {
+			'uid': _as_text(account['uid']),
+			'wid': '',
+			'domain': _as_text(account['domain']),
+			'regcode': '',
+			'error': f"{status.error()} / {status.info()}",
+		}
+	
+	uid = status['uid'] if status.has_value('uid') and status['uid'] else account['uid']
+	return {
+		'uid': _as_text(uid),
+		'wid': _as_text(status['wid']),
+		'domain': _as_text(status['domain']),
+		'regcode': status['regcode'],
+		'error': '',
+	}
+
+
+def _prereg_worker(profile_folder: str, ready: Future, jobs: queue.Queue):
+	'''A worker thread for preregister_accounts(). It logs into the active profile's account with
+	a client of its own, which is created and used only on this thread, and reports the result
+	through ready. It then preregisters accounts from the queue until it gets None. Each queue
+	item is an account and the Future which receives its result.'''
+	shellstate = ShellState(profile_folder)
+	try:
+		status = shellstate.client.pman.get_active_profile()
+		if not status.error():
+			profile = status['profile']
+			addr = MAddress(profile.wid.as_string() + '/' + profile.domain.as_string())
+			status = shellstate.client.connect(addr.domain)
+			if not status.error():
+				status = shellstate.client.login(addr)
+	except Exception as e:
+		status = RetVal().wrap_exception(e)
+	ready.set_result(status)
+
+	while True:
+		job = jobs.get()
+		if job is None:
+			break
+		account, result = job
+		try:
+			result.set_result(_preregister_one(shellstate.client, account))
+		except Exception as e:
+			result.set_exception(e)
 	
-	status = shellstate.client.pman.get_active_profile()
 	if not status.error():
-		profile = status['profile']
-	status = load_user_field(profile.db, '*')
-	if status.error():
-		return status
+		shellstate.client.logout()
+	shellstate.client.disconnect()
+
+
+def preregister_accounts(client, accounts: list, jobs=1, profile_folder=''):
+	'''Preregisters a list of accounts from _load_prereg_file(). A dictionary with the keys uid,
+	wid, domain, regcode, and error is yielded for each account, in the order of the list, as soon
+	as it and those before it are finished.
+
+	With one job, the requests are sent one after another over the client's connection, which must
+	be logged in as the administrator, and this stops early if the connection is lost. With more,
+	that many worker threads each log into the active profile's account -- the administrator's --
+	with a client of their own, the same way `mdshell --jobs` gives each worker its own
+	ShellState, and send requests at the same time. If any of them can't log in, no requests are
+	sent and every account gets the login error.'''
+	if jobs < 2:
+		for account in accounts:
+			result = _preregister_one(client, account)
+			yield result
+			if result['error'] and not client.conn.is_connected():
+				return
+		return
+	
+	workqueue = queue.Queue()
+	with ThreadPoolExecutor(jobs) as pool:
+		readies = [ Future() for _ in range(jobs) ]
+		for ready in readies:
+			pool.submit(_prereg_worker, profile_folder, ready, workqueue)
+		
+		try:
+			failed = [ f.result() for f in readies if f.result().error() ]
+			if failed:
+				for account in accounts:
+					yield {
+						'uid': _as_text(account['uid']),
+						'wid': '',
+						'domain': _as_text(account['domain']),
+						'regcode': '',
+						'error': f"Admin login failed: {failed[0].error()} / {failed[0].info()}",
+					}
+				return
+			
+			results = list()
+			for account in accounts:
+				results.append(Future())
+				workqueue.put((account, results[-1]))
+			for result in results:
+				yield result.result()
+		finally:
+			# If the caller stops early, accounts which haven't been started are dropped
+			while True:
+				try:
+					workqueue.get_nowait()
+				except queue.Empty:
+					break
+			for _ in range(jobs):
+				workqueue.put(None)
+
+
+def _preregister_from_file(shellstate: ShellState, accounts: list, outpath: str,
+		jobs: int) -> RetVal:
+	'''Implements `preregister from=<file>`. Results are written to outpath as they arrive, in the
+	order of the file, as JSON lines if its name ends in .jsonl and CSV otherwise, so that the
+	registration codes for accounts already created are kept if the batch is interrupted.'''
+	fieldnames = [ 'uid', 'wid', 'domain', 'regcode', 'error' ]
+	fhandle = None
+	if outpath:
+		try:
+			fhandle = open(os.path.expanduser(outpath), 'w', newline='', encoding='utf8')
+		except Exception as e:
+			return RetVal().wrap_exception(e)
+		if outpath.casefold().endswith('.jsonl'):
+			writerow = lambda row: fhandle.write(json.dumps(row, ensure_ascii=False) + '\n')
+		else:
+			writer = csv.DictWriter(fhandle, fieldnames=fieldnames)
+			writer.writeheader()
+			writerow = writer.writerow
+
+	results = list()
+	out = list()
+	try:
+		for result in preregister_accounts(shellstate.client, accounts, jobs,
+				shellstate.profile_folder):
+			results.append(result)
+			if fhandle:
+				writerow(result)
+				fhandle.flush()
+			elif not result['error']:
+				out.append(f"{result['uid'] or '-'} {result['wid']} {result['regcode']}")
+			
+			if result['error']:
+				out.append(f"Error for {result['uid'] or 'none'}: {result['error']}")
+	finally:
+		if fhandle:
+			fhandle.close()
+	
+	failed = len([ r for r in results if r['error'] ])
+	out.append(f"\n{len(results) - failed} of {len(accounts)} accounts preregistered")
+	if len(results) < len(accounts):
+		out.append(f"Connection lost. {len(accounts) - len(results)} accounts not sent.")
+	if outpath:
+		out.append(f"Results saved to {outpath}")
+	
+	return RetVal(ErrServerError if failed or len(results) < len(accounts) else ErrOK,
+		'\n'.join(out)).set_values({ 'results': results })
+
+
+def _format_check_errors(errors: dict) -> RetVal:
+	'''Turns the errors from check_contact_fields() into a RetVal suitable for display'''
+	out = list()
+	outstatus = RetVal(ErrBadData)
+	if 'invalid' in errors:
+		out.append('The following fields were invalid:')
+		out.extend(errors['invalid'])
+		outstatus.set_value('invalid', errors['invalid'])
+	
+	if 'missing' in errors:
+		out.append('\nThe following field components were missing:')
+		out.extend(errors['missing'])
+		outstatus.set_value('missing', errors['missing'])
+	
+	outstatus.set_info('\n'.join(out))
+	return outstatus
 
-	errors = dict()
 
-	# Check validity of all fields
-	for field in status['name']:
-		if not _is_field_valid(field):
-			if 'invalid' not in errors:
-				errors['invalid'] = list()
-			errors['invalid'].append(field)
-	
-	# Check for required values. If we got this far, then all field names are valid. We just need
-	# to ensure that subfields that are required exist.
-	# Merge the values into a dictionary so we can unflatten and verify	
-	flatcontact = dict()
-	for i in range(len(status['name'])):
-		flatcontact[status['name'][i]] = status['value'][i]
-	status.empty()
-	status = unflatten(flatcontact)
+class _BatchedDB:
+	'''Wraps a database connection so that the userinfo functions, which commit after each write,
+	leave committing to the caller. This makes a series of writes a single transaction.'''
+	def __init__(self, db):
+		self._db = db
+	
+	def commit(self):
+		pass
+
+	def __getattr__(self, name):
+		return getattr(self._db, name)
+
+
+def _field_group(name: str) -> str:
+	'''Returns the top-level field which a field specifier belongs to, such as `Phone` for
+	`Phone.0.Label` or `Annotations.Phone` for `Annotations.Phone.0.Label`'''
+	parts = name.split('.', 2)
+	if parts[0] == 'Annotations' and len(parts) > 1:
+		return f"Annotations.{parts[1]}"
+	return parts[0]
+
+
+def _merge_fields(existing: dict, fields: dict) -> dict:
+	'''Merges imported fields into a profile's existing ones. Each top-level field in the import
+	replaces the existing one as a whole so that lists don't keep leftover entries, and all others
+	are kept. This keeps the workspace fields written at registration when importing a vCard, which
+	has no way to express them.'''
+	groups = set([ _field_group(name) for name in fields ])
+	out = { k: v for k, v in existing.items() if _field_group(k) not in groups }
+	out.update(fields)
+	return out
+
+
+def _import_fields(db, fields: dict) -> RetVal:
+	'''Merges the flattened fields given into a profile's contact information, as described for
+	_merge_fields(), in a single transaction. Either all of the changes are made or none of them
+	are.'''
+
+	status = load_user_field(db, '*')
+	existing = dict() if status.error() else dict(zip(status['name'], status['value']))
+	merged = _merge_fields(existing, fields)
+
+	# The writes go through pymensago's userinfo functions, which own the table layout. Until the
+	# commit below, they are pending on the profile's shared connection, so any failure has to
+	# roll them back or the next unrelated write would commit them.
+	batch = _BatchedDB(db)
+	try:
+		for name in existing:
+			if name not in merged:
+				status = delete_user_field(batch, name)
+				if status.error():
+					db.rollback()
+					return status
+		
+		for name, value in fields.items():
+			status = save_user_field(batch, name, value)
+			if status.error():
+				db.rollback()
+				return status
+	except Exception as e:
+		db.rollback()
+		return RetVal().wrap_exception(e)
+	
+	db.commit()
+	return RetVal(ErrOK, f"Imported {len(fields)} fields")
+
+
+def _export_fields(db, path: str) -> RetVal:
+	'''Exports a profile's contact information as JSON to a file or, if no path is given, as the
+	returned info'''
+
+	status = load_user_field(db, '*')
 	if status.error():
 		return status
 	
-	contact = status['value']
+	status = unflatten(dict(zip(status['name'], status['value'])))
+	if status.error():
+		return status
+	
+	data = json.dumps(status['value'], ensure_ascii=False, indent='\t')
+	if not path:
+		return RetVal(ErrOK, data)
+	
+	try:
+		with open(path, 'w', encoding='utf8') as fhandle:
+			fhandle.write(data)
+	except Exception as e:
+		return RetVal().wrap_exception(e)
+	
+	return RetVal(ErrOK, f"Contact information exported to {path}")
+
+
+def _flatten(value, prefix='') -> dict:
+	'''Flattens a contact into a dictionary of field specifiers and string values, such as
+	`Phone.0.Label`. This is the inverse of pymensago.contact.unflatten().'''
+	if isinstance(value, dict):
+		items = value.items()
+	elif isinstance(value, list):
+		items = enumerate(value)
+	else:
+		return { prefix: value if isinstance(value, str) else str(value) }
+	
+	out = dict()
+	for key, item in items:
+		out.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+	return out
 
-	for toplevel in _dictlist_fields.keys():
-		
-		# Checks only matter if the field itself exists in the contact
-		if toplevel in contact:
 
-			# The field exists in the contact, so we will check to ensure that each required field
-			# in the spec for the entry actually exists
-			for item in contact[toplevel]:
-				for key in _dictlist_fields[toplevel].keys():
-					# Each item is true if it is required
-					if _dictlist_fields[toplevel][key] and key not in item:
-						if 'missing' not in errors:
-							errors['missing'] = list()
-						errors['missing'].append(f'{key} missing from {toplevel} item')
+def _load_contact_file(path: str) -> RetVal:
+	'''Loads a contact from a JSON or vCard file. The flattened fields are returned in the 'fields'
+	field. JSON files may hold either a contact or its flattened fields.'''
+	
+	try:
+		with open(os.path.expanduser(path), 'r', encoding='utf8') as fhandle:
+			data = fhandle.read()
+	except Exception as e:
+		return RetVal().wrap_exception(e)
+	
+	if path.casefold().endswith(('.vcf', '.vcard')):
+		fields = _vcard_to_fields(data)
+	else:
+		try:
+			contact = json.loads(data)
+		except Exception as e:
+			return RetVal(ErrBadData, f"{path} isn't valid JSON: {e}")
+		if not isinstance(contact, dict):
+			return RetVal(ErrBadData, f"{path} doesn't contain a contact")
+		fields = _flatten(contact)
+	
+	if not fields:
+		return RetVal(ErrBadData, f"No contact information found in {path}")
+	
+	return RetVal().set_value('fields', fields)
+
+
+# vCard properties which map to a single top-level field
+_vcard_fields = {
+	'FN': 'FormattedName',
+	'GENDER': 'Gender',
+	'BDAY': 'Birthday',
+	'ANNIVERSARY': 'Anniversary',
+	'EMAIL': 'Email',
+	'TITLE': 'Title',
+	'NOTE': 'Notes',
+}
+
+# vCard properties which map to dictionary list items with a label and a value, along with the
+# label used if the property has no TYPE
+_vcard_items = {
+	'TEL': ('Phone', 'Phone'),
+	'URL': ('Websites', 'Website'),
+	'IMPP': ('Messaging', 'Messaging'),
+}
+
+_vcard_split = re.compile(r'(?<!\\);')
+_vcard_escapes = re.compile(r'\\(.)')
 
-	if len(errors):
-		return RetVal(ErrBadData).set_value('errors', errors)
+def _vcard_unescape(value: str) -> str:
+	return _vcard_escapes.sub(lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def _vcard_to_fields(data: str) -> dict:
+	'''Converts the first contact in a vCard to flattened contact fields. Properties which have no
+	equivalent in the Mensago contact spec are ignored.'''
+	
+	# Long lines are folded by starting continuation lines with whitespace
+	lines = re.sub(r'\r?\n[ \t]', '', data).splitlines()
+
+	fields = dict()
+	lists = dict()
+	for line in lines:
+		nameparams, sep, value = line.partition(':')
+		if not sep:
+			continue
+		params = nameparams.split(';')
+		name = params[0].split('.')[-1].upper()
+		types = [ p.split('=', 1)[1] for p in params[1:] if p.upper().startswith('TYPE=') ]
+		label = types[0].split(',')[0].capitalize() if types else ''
+		
+		if name == 'END':
+			break
+		
+		if name in _vcard_fields:
+			if _vcard_fields[name] not in fields:
+				fields[_vcard_fields[name]] = _vcard_unescape(value)
+		
+		elif name == 'N':
+			parts = [ _vcard_unescape(p) for p in _vcard_split.split(value) ] + [ '' ] * 5
+			for field, part in [ ('FamilyName', parts[0]), ('GivenName', parts[1]),
+					('Prefix', parts[3]) ]:
+				if part:
+					fields[field] = part
+			for field, part in [ ('AdditionalNames', parts[2]), ('Suffixes', parts[4]) ]:
+				lists.setdefault(field, list()).extend([ p for p in part.split(',') if p ])
+		
+		elif name in [ 'NICKNAME', 'CATEGORIES', 'LANG' ]:
+			field = { 'NICKNAME': 'Nicknames', 'CATEGORIES': 'Categories', 'LANG': 'Languages' }[name]
+			lists.setdefault(field, list()).extend([ _vcard_unescape(p) for p in value.split(',')
+				if p ])
+		
+		elif name == 'ORG':
+			parts = [ _vcard_unescape(p) for p in _vcard_split.split(value) if p ]
+			if parts:
+				fields['Organization'] = parts[0]
+				lists.setdefault('OrgUnits', list()).extend(parts[1:])
+		
+		elif name in _vcard_items:
+			field, default = _vcard_items[name]
+			lists.setdefault(field, list()).append({ 'Label': label or default,
+				'Value': _vcard_unescape(value) })
+		
+		elif name == 'ADR':
+			parts = [ _vcard_unescape(p) for p in _vcard_split.split(value) ] + [ '' ] * 7
+			address = { 'Label': label or 'Address' }
+			for key, part in zip([ 'POBox', 'ExtendedAddress', 'StreetAddress', 'Locality',
+					'Region', 'PostalCode', 'Country' ], parts):
+				if part:
+					address[key] = part
+			lists.setdefault('MailingAddresses', list()).append(address)
 	
-	return RetVal()
+	fields.update(_flatten({ k: v for k, v in lists.items() if v }))
+	return fields
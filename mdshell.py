@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 '''This is the main module'''
 
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import re
+import sys
+import threading
 
 from prompt_toolkit import HTML
 from prompt_toolkit import PromptSession
 from prompt_toolkit.completion import Completer, Completion, ThreadedCompleter
+from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.shortcuts.utils import print_formatted_text
+from retval import RetVal
 
-from commandaccess import init_commands, get_command, get_command_names
-from shellbase import ShellState
+from commandaccess import init_commands, get_command, get_command_completions
+from shellbase import BaseCommand, Job, ShellState
 
 class ShellCompleter(Completer):
 	'''Class for handling command autocomplete'''
@@ -25,10 +32,8 @@ class ShellCompleter(Completer):
 			commandToken = tokens[0]
 
 			# We have only one token, which is the command name
-			names = get_command_names()
-			for name in names:
-				if name.startswith(commandToken):
-					yield Completion(name[len(commandToken):],display=name)
+			for name in get_command_completions(commandToken):
+				yield Completion(name[len(commandToken):],display=name)
 		elif tokens:
 			cmd = get_command(tokens[0])
 			if cmd.name != 'unrecognized':
@@ -37,39 +42,210 @@ class ShellCompleter(Completer):
 					yield Completion(out[0],display=out[1],	start_position=-len(tokens[-1]))
 
 
-if __name__ == '__main__':
+async def run_job(job: Job, cmd: BaseCommand, shellstate: ShellState):
+	'''Runs a command as a background job in the session for its server and prints its results
+	when it finishes'''
+	session = shellstate.pool.acquire(job.domain)
+	try:
+		job.status = await asyncio.wrap_future(session.submit(cmd))
+	except Exception as e:
+		job.status = RetVal().wrap_exception(e)
+	else:
+		cmd.finish(shellstate, job.domain, job.status)
+	
+	print_formatted_text(HTML(f"<gray>[{job.id}] {job.state()}: {job.cmdline}</gray>"))
+	if job.status.info():
+		print_formatted_text(HTML(job.status.info()))
+
+
+def prepare_command(raw_input: str, shellstate: ShellState) -> RetVal:
+	'''Gets the command for a line of input and runs its set() and validate() methods. The
+	command instance is returned in the 'command' field.'''
+	tokens = raw_input.split(' ')
+	
+	cmd = get_command(tokens[0])
+	status = cmd.set(raw_input)
+	if status.error():
+		return status
+	
+	status = cmd.validate(shellstate)
+	if status.error():
+		return status
+	
+	return RetVal().set_value('command', cmd)
+
+
+def run_command(raw_input: str, shellstate: ShellState) -> RetVal:
+	'''Runs one line of input all the way through the command pipeline'''
+	status = prepare_command(raw_input, shellstate)
+	if status.error():
+		return status
+	
+	try:
+		return status['command'].execute(shellstate)
+	except Exception as e:
+		return RetVal().wrap_exception(e)
+
+
+async def main():
+	'''The main event loop'''
 	init_commands()
 	shellstate = ShellState()
 
 	session = PromptSession()
 	commandCompleter = ThreadedCompleter(ShellCompleter(shellstate))
 	
-	while True:
-		try:
-			raw_input = session.prompt(HTML('<yellow><b> :> </b></yellow>' ),
-									completer=commandCompleter)
-		except KeyboardInterrupt:
-			break
-		except EOFError:
-			break
-		else:
+	with patch_stdout():
+		while True:
+			try:
+				raw_input = await session.prompt_async(HTML('<yellow><b> :> </b></yellow>' ),
+										completer=commandCompleter)
+			except KeyboardInterrupt:
+				break
+			except EOFError:
+				break
+			
 			raw_input = raw_input.strip()
 			if not raw_input:
 				continue
 			
-			tokens = raw_input.split(' ')
-			
-			cmd = get_command(tokens[0])
-			status = cmd.set(raw_input)
+			status = prepare_command(raw_input, shellstate)
 			if status.error():
 				print(status.info())
 				continue
+			cmd = status['command']
 			
-			status = cmd.validate(shellstate)
-			if status.error():
-				print(status.info())
+			if cmd.is_background():
+				job = Job(shellstate.next_job_id, raw_input, cmd.job_domain(shellstate))
+				shellstate.next_job_id += 1
+				shellstate.current_domain = job.domain
+				shellstate.jobs[job.id] = job
+				job.task = asyncio.create_task(run_job(job, cmd, shellstate))
+				print(f"[{job.id}] {raw_input}")
 				continue
-			
-			status = cmd.execute(shellstate)
+
+			try:
+				status = cmd.execute(shellstate)
+			except SystemExit:
+				break
 			if status.info():
 				print_formatted_text(HTML(status.info()))
+		
+		running = [ job.task for job in shellstate.jobs.values() if job.status is None ]
+		if running:
+			print(f"Waiting for {len(running)} background job(s) to finish")
+			await asyncio.gather(*running)
+	
+	shellstate.pool.close()
+
+
+# Each batch worker thread has its own ShellState, and with it its own client and connection
+_worker = threading.local()
+
+def _run_batch_line(raw_input: str) -> RetVal:
+	if not hasattr(_worker, 'shellstate'):
+		_worker.shellstate = ShellState()
+	return run_command(raw_input, _worker.shellstate)
+
+
+def _report(linenum: int, raw_input: str, status: RetVal):
+	'''Prints the results of a command in batch mode. Errors go to stderr.'''
+	if status.error():
+		print(f"line {linenum}: {raw_input}\n{status.error()}: {status.info()}", file=sys.stderr)
+	elif status.info():
+		print(status.info())
+
+
+def run_batch(lines, jobs: int, keep_going: bool) -> RetVal:
+	'''Runs command lines without a prompt. Blank lines and lines starting with # are skipped.
+	Lines are run in order unless jobs is greater than 1, in which case they are run concurrently
+	and must not depend on each other. Unless keep_going is set, lines after the first failure
+	aren't run, although with several jobs some may already have started. An exit command ends the
+	batch. The RetVal of the first failure, if any, is returned.'''
+	init_commands()
+	
+	commands = list()
+	for i, line in enumerate(lines):
+		line = line.strip()
+		if line and not line.startswith('#'):
+			commands.append((i + 1, line))
+	
+	failure = None
+	if jobs > 1:
+		# The index of the earliest line which failed or exited. Lines after it are skipped unless
+		# keep_going is set, and they are always skipped after an exit.
+		stop = [ len(commands) ]
+		stop_lock = threading.Lock()
+
+		def run_line(index: int):
+			if index > stop[0]:
+				return None
+			try:
+				status = _run_batch_line(commands[index][1])
+			except SystemExit:
+				status = None
+			if status is None or (status.error() and not keep_going):
+				with stop_lock:
+					stop[0] = min(stop[0], index)
+			return status
+		
+		with ThreadPoolExecutor(jobs) as pool:
+			for index, status in enumerate(pool.map(run_line, range(len(commands)))):
+				if status is None:
+					if index == stop[0]:
+						break
+					continue
+				_report(*commands[index], status)
+				if status.error() and failure is None:
+					failure = status
+		return failure if failure is not None else RetVal()
+	
+	shellstate = ShellState()
+	for linenum, line in commands:
+		try:
+			status = run_command(line, shellstate)
+		except SystemExit:
+			break
+		_report(linenum, line, status)
+		if status.error():
+			if not keep_going:
+				return status
+			if failure is None:
+				failure = status
+	
+	return failure if failure is not None else RetVal()
+
+
+def handle_arguments() -> argparse.Namespace:
+	'''Parses the command-line arguments'''
+	parser = argparse.ArgumentParser(description='A shell for Mensago development. Commands are '
+		'read from a script or a pipe instead of the prompt if either is given.')
+	parser.add_argument('--script', type=str, default='',
+		help='run the commands in this file and exit')
+	parser.add_argument('--jobs', type=int, default=1,
+		help='run this many independent commands at once in batch mode')
+	parser.add_argument('--keep-going', action='store_true',
+		help='keep running commands in batch mode after one fails')
+	args = parser.parse_args()
+	if args.jobs < 1:
+		parser.error('--jobs must be positive')
+	return args
+
+
+if __name__ == '__main__':
+	options = handle_arguments()
+
+	if options.script or not sys.stdin.isatty():
+		try:
+			if options.script:
+				with open(options.script, 'r') as fhandle:
+					status = run_batch(fhandle.readlines(), options.jobs, options.keep_going)
+			else:
+				status = run_batch(sys.stdin, options.jobs, options.keep_going)
+		except OSError as e:
+			print(f"Unable to read {options.script}: {e}", file=sys.stderr)
+			sys.exit(1)
+		
+		sys.exit(1 if status.error() else 0)
+
+	asyncio.run(main())
@@ -1,15 +1,17 @@
 '''Provides the command processing API'''
 # pylint: disable=unused-argument
 
+from bisect import bisect_left
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
 import os
 import re
+import time
 
-from pymensago.client import MensagoClient
 from retval import ErrBadType, ErrBadValue, RetVal
 
-# This global is needed for meta commands, such as Help. Do not access this list directly unless
-# there is literally no other option.
+# Command classes by name, which commandaccess.get_command() loads the first time each is used.
+# Do not access this list directly unless there is literally no other option.
 gShellCommands = dict()
 
 class ShellState:
@@ -22,18 +24,229 @@ class ShellState:
 			self.oldpwd = ''
 		
 		self.aliases = dict()
-		self.client = MensagoClient(profile_folder)
+		self.profile_folder = profile_folder
+		self._client = None
+
+		# The item indices in use for each list and dictionary list field, by profile name. myinfo
+		# fills this in when first needed for completion. Anything that changes a profile's
+		# fields, or which profile a name refers to, empties it.
+		self.field_slots = dict()
+
+		# Background jobs by job ID. Jobs don't use the client above. Each runs in the session for
+		# the server it talks to, and current_domain is the server of the most recent one.
+		self.jobs = dict()
+		self.next_job_id = 1
+		self.current_domain = ''
+
+		self.pool = ConnectionPool(profile_folder)
+
+	@property
+	def client(self):
+		'''The MensagoClient used by commands. It is created the first time it is needed, which
+		saves loading pymensago's client and profile code when starting the shell.'''
+		if self._client is None:
+			from pymensago.client import MensagoClient
+			self._client = MensagoClient(self.profile_folder)
+		return self._client
+	
+	@property
+	def loaded_client(self):
+		'''The client if it has been created and None otherwise. Code which runs on other threads,
+		such as completion, uses this because it must not create the client.'''
+		return self._client
+	
+	def reset_client(self):
+		'''Drops the client so that the next use creates a new one, which loads the profile from
+		disk again, and empties the cached field slots. This is for when a background job has
+		changed the profile.'''
+		self._client = None
+		self.field_slots.clear()
+
+
+class ServerSession:
+	'''A client of its own for talking to one server. The client is created on the session's
+	thread and only ever used from it, so its profile database connection stays on one thread.
+	Commands given to a session run one after another in the order they were submitted.'''
+	def __init__(self, domain: str, profile_folder: str):
+		self.domain = domain
+		self.profile_folder = profile_folder
+		self.executor = ThreadPoolExecutor(1)
+		self.last_used = time.monotonic()
+
+		# The ShellState whose client the session's commands use, created by the first command
+		self.state = None
+		self._last_job = None
+
+	def submit(self, cmd: 'BaseCommand') -> Future:
+		'''Queues a command to be executed with the session's client. The returned Future gives
+		the command's RetVal.'''
+		self.last_used = time.monotonic()
+		self._last_job = self.executor.submit(self._execute, cmd)
+		return self._last_job
+
+	def is_busy(self) -> bool:
+		'''Returns true if any commands are running or queued'''
+		return self._last_job is not None and not self._last_job.done()
+
+	def is_connected(self) -> bool:
+		'''Returns true if the session's client has an open connection'''
+		client = self.state._client if self.state is not None else None
+		return client is not None and client.conn.is_connected()
+
+	def close(self):
+		'''Disconnects once any queued commands have finished and then stops the session's
+		thread'''
+		self.executor.submit(self._disconnect)
+		self.executor.shutdown(wait=False)
+
+	def _execute(self, cmd: 'BaseCommand') -> RetVal:
+		if self.state is None:
+			self.state = ShellState(self.profile_folder)
+		try:
+			return cmd.execute(self.state)
+		finally:
+			self.last_used = time.monotonic()
+
+	def _disconnect(self):
+		if self.state is not None and self.state._client is not None:
+			try:
+				self.state._client.disconnect()
+			except Exception:
+				pass
+
+
+class ConnectionPool:
+	'''Keeps a session for each server domain so that commands for a server reuse its open
+	connection instead of making a new TCP and TLS handshake each time, and so that jobs for
+	different servers run at the same time. A session's connection is checked before each command,
+	and sessions are closed once they have been idle for max_idle seconds. If there are more than
+	max_size sessions, the least recently used idle one is closed. The pool is only used from the
+	shell's main thread.'''
+	def __init__(self, profile_folder='', max_idle=300.0, max_size=8):
+		self.profile_folder = profile_folder
+		self.max_idle = max_idle
+		self.max_size = max_size
+		
+		# ServerSessions by domain, in order of least recently used
+		self.sessions = dict()
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def acquire(self, domain: str) -> ServerSession:
+		'''Returns the session for a domain, creating one if needed'''
+		self._evict_idle()
+		
+		session = self.sessions.pop(domain, None)
+		if session is not None and session.is_connected():
+			self.hits += 1
+		else:
+			self.misses += 1
+		
+		if session is None:
+			session = ServerSession(domain, self.profile_folder)
+		self.sessions[domain] = session
+
+		excess = len(self.sessions) - self.max_size
+		if excess > 0:
+			for key in [ k for k, v in self.sessions.items() if not v.is_busy() ][:excess]:
+				self._evict(key)
+		
+		return session
+
+	def evict(self, domain: str):
+		'''Closes the session for a domain, if there is one and it has no commands queued'''
+		if domain in self.sessions and not self.sessions[domain].is_busy():
+			self._evict(domain)
+
+	def close(self):
+		'''Closes all sessions'''
+		for key in list(self.sessions.keys()):
+			self._evict(key)
+
+	def stats(self) -> dict:
+		'''Returns a dictionary of pool statistics and the idle time, connection state, and
+		whether it is busy for each session'''
+		now = time.monotonic()
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'connections': { k: {
+					'idle': 0.0 if v.is_busy() else now - v.last_used,
+					'connected': v.is_connected(),
+					'busy': v.is_busy(),
+				} for k, v in self.sessions.items() },
+		}
+
+	def _evict(self, key: str):
+		self.sessions.pop(key).close()
+		self.evictions += 1
+
+	def _evict_idle(self):
+		now = time.monotonic()
+		for key in [ k for k, v in self.sessions.items()
+				if not v.is_busy() and now - v.last_used > self.max_idle ]:
+			self._evict(key)
+
+
+class Job:
+	'''Tracks a command running in the background'''
+	def __init__(self, jobid: int, cmdline: str, domain=''):
+		self.id = jobid
+		self.cmdline = cmdline
+		self.domain = domain
+		self.task = None
+
+		# The RetVal returned by the command once it has finished
+		self.status = None
+	
+	def state(self) -> str:
+		'''Returns a short description of the job's state'''
+		if self.status is None:
+			return 'running'
+		return 'failed' if self.status.error() else 'done'
+
+
+class PrefixIndex:
+	'''A sorted list of words which can quickly find all of those starting with a prefix. Lookups
+	take O(log n) time plus the number of matches, so completion stays fast as words are added.'''
+	def __init__(self, words=None):
+		self.words = sorted(set(words)) if words else list()
+	
+	def add(self, word: str):
+		'''Adds a word to the index'''
+		index = bisect_left(self.words, word)
+		if index == len(self.words) or self.words[index] != word:
+			self.words.insert(index, word)
+
+	def matches(self, prefix: str) -> list:
+		'''Returns a sorted list of the words which start with the prefix'''
+		out = list()
+		for index in range(bisect_left(self.words, prefix), len(self.words)):
+			if not self.words[index].startswith(prefix):
+				break
+			out.append(self.words[index])
+		return out
 
 
 class BaseCommand:
-	'''The main base Command class. Defines the basic API and all tagsh commands inherit from it.'''
+	'''The main base Command class. Defines the basic API and all tagsh commands inherit from it.
 
-	def __init__(self):
+	A command's name, help, and description are class attributes shared by every instance. An
+	instance holds only the arguments for a single invocation, so commandaccess.get_command()
+	returns a new one each time and invocations can run concurrently without stepping on each
+	other. Subclasses should set __slots__ to an empty tuple to keep instances small.'''
 
-		self.name = ''
-		self.help = ''
-		self.description = ''
-		self.keywords = None
+	__slots__ = ('rawcmd', 'tokens', 'args')
+
+	name = ''
+	help = ''
+	description = ''
+	keywords = None
+
+	def __init__(self):
 
 		# Argument-handling attributes
 		self.rawcmd = ''
@@ -52,8 +265,6 @@ class BaseCommand:
 		# `cmd foo "bar=spam eggs"`
 		self.args = dict()
 
-		self.splitter = re.compile(r'\"(?:\%\"|[^\"])*\"|\"[^\"]*\"|[^\s\"]+')
-
 	def set(self, command: str) -> RetVal:
 		'''Sets the input and does some basic validation. This method expects the entire raw 
 		command, including the command name.'''
@@ -79,6 +290,23 @@ class BaseCommand:
 
 		return dict()
 	
+	def is_background(self) -> bool:
+		'''Returns true if the command should be run as a background job. This is meant for
+		commands which spend most of their time waiting on a server. Commands which prompt the user
+		for input must not run in the background. It is called after validate().'''
+		return False
+
+	def job_domain(self, shellstate: ShellState) -> str:
+		'''Returns the domain of the server a background command talks to. Jobs for a domain run
+		one at a time in its session, but jobs for different domains run at the same time. The
+		default is the server of the most recent job. It is called after validate().'''
+		return shellstate.current_domain
+
+	def finish(self, shellstate: ShellState, domain: str, status: RetVal):
+		'''A hook called on the main thread after the command has run as a background job, for
+		updating the shell's state to match. status is the RetVal returned by execute().'''
+		return
+
 	def execute(self, shellstate: ShellState) -> RetVal:
 		'''The base class purposely does nothing. To be implemented by subclasses'''
 
@@ -104,30 +332,46 @@ containing matches.'''
 		places them in self.tokens. This method handles double-quotes for encapsulating arguments 
 		and escaping a quotation mark within them using a %, i.e. `cmd "foo %"bar%""` yields the 
 		tokens `cmd` and `foo "bar"`. '''
-		raw_tokens = re.findall(self.splitter, self.rawcmd.strip())
-		if raw_tokens:
-			del raw_tokens[0]
-		
-		self.tokens = list()
-		for i in range(len(raw_tokens)):
-			token = raw_tokens[i].strip('"').replace('%"','"')
-			if '=' in token:
-				parts = token.split('=', 1)
-				# A token like `=foo` will not be treated as a key=value pair.
-				if parts[0]:
-					self.args[parts[0]] = parts[1]
-					continue
-			
-			self.tokens.append(token)
-
+		self.tokens, args = tokenize(self.rawcmd)
+		self.args.update(args)
 		return RetVal()
 
 
+# Matches one token of a command line: either a quoted string, whose contents are group 1, or a
+# run of characters which are neither whitespace nor quotes, which is group 2. The quoted form is written so that
+# runs of ordinary characters are taken all at once and each repetition has to start with a %,
+# which keeps long pasted values fast and rules out runaway backtracking on an unclosed quote.
+_token_pattern = re.compile(r'"([^"%]*(?:%"?[^"%]*)*)"|([^\s"]+)')
+
+def tokenize(command: str):
+	'''Splits a command line into its arguments in a single pass and returns a list of the ordered
+	tokens and a dictionary of the named arguments. The command name itself is skipped. See
+	BaseCommand for the syntax.'''
+	tokens = list()
+	args = dict()
+
+	matches = _token_pattern.findall(command)
+	for quoted, token in matches[1:]:
+		# Unquoted tokens are never empty, so an empty one means the token was quoted
+		if not token:
+			token = quoted.replace('%"', '"') if '%"' in quoted else quoted
+		
+		if '=' in token:
+			key, _, value = token.partition('=')
+			# A token like `=foo` will not be treated as a key=value pair.
+			if key:
+				args[key] = value
+				continue
+		
+		tokens.append(token)
+	
+	return tokens, args
+
+
 class FilespecBaseCommand(BaseCommand):
 	'''Many commands operate on a list of file specifiers'''
-	def __init__(self, raw_input=None, ptoken_list=None):
-		super().__init__(self,raw_input,ptoken_list)
-		self.name = 'FilespecBaseCommand'
+	__slots__ = ()
+	name = 'FilespecBaseCommand'
 		
 	def process_wildcards(self, tokens: list) -> list:
 		'''Converts a list containing filenames and/or wildcards into a list of file paths.'''
@@ -155,6 +399,74 @@ class FilespecBaseCommand(BaseCommand):
 		return out
 
 
+# Directory listings used for path completion, by absolute path. Each entry holds the directory's
+# modification time, a PrefixIndex of the names in it, and the set of those which are directories.
+# Listing a directory once and reusing it until it changes keeps completion from stalling on slow
+# or network filesystems.
+_listing_cache = dict()
+_listing_cache_size = 64
+
+def _list_directory(path: str):
+	'''Returns the cached PrefixIndex of names in a directory and the set of those which are
+	directories, listing it again only if it has changed'''
+	abspath = os.path.abspath(path)
+	try:
+		mtime = os.stat(abspath).st_mtime_ns
+		cached = _listing_cache.get(abspath)
+		if cached and cached[0] == mtime:
+			return cached[1], cached[2]
+
+		names = list()
+		dirs = set()
+		with os.scandir(abspath) as entries:
+			for entry in entries:
+				names.append(entry.name)
+				try:
+					if entry.is_dir():
+						dirs.add(entry.name)
+				except OSError:
+					pass
+	except OSError:
+		return PrefixIndex(), set()
+
+	if abspath not in _listing_cache and len(_listing_cache) >= _listing_cache_size:
+		del _listing_cache[next(iter(_listing_cache))]
+	index = PrefixIndex(names)
+	_listing_cache[abspath] = (mtime, index, dirs)
+	return index, dirs
+
+
+def get_path_completions(token: str, dirs_only=False) -> list:
+	'''Returns a list of [path, isdir] pairs for each file or directory which starts with the
+	token. Like glob(), hidden entries are only returned if the token's last component starts
+	with a dot.'''
+	dirpart, namepart = os.path.split(token)
+	index, dirs = _list_directory(dirpart if dirpart else os.curdir)
+
+	out = list()
+	for name in index.matches(namepart):
+		if name[0] == '.' and not namepart.startswith('.'):
+			continue
+		isdir = name in dirs
+		if dirs_only and not isdir:
+			continue
+		out.append([os.path.join(dirpart, name), isdir])
+	return out
+
+
+def get_dir_completions(token: str):
+	'''Implements autocompletion for commands which take a directory'''
+
+	quote_mode = bool(token and token[0] == '"')
+	out_data = list()
+	for item, _ in get_path_completions(token[1:] if quote_mode else token, True):
+		if quote_mode or ' ' in item:
+			out_data.append(['"' + item + '"', item])
+		else:
+			out_data.append([item, item])
+	return out_data
+
+
 def get_filespec_completions(token: str):
 	'''Implements autocompletion for commands which take a filespec. This be a directory, filename, 
 	or wildcard. If a wildcard, this method returns no results.'''
@@ -167,18 +479,18 @@ def get_filespec_completions(token: str):
 	quoteMode = bool(token[0] == '"')
 	
 	if quoteMode:
-		items = glob(token[1:] + '*')
+		items = get_path_completions(token[1:])
 	else:
-		items = glob(token + '*')
+		items = get_path_completions(token)
 	
-	for item in items:
+	for item, isdir in items:
 		display = item
 		if quoteMode or ' ' in item:
 			data = '"' + item + '"'
 		else:
 			data = item
 		
-		if os.path.isdir(item):
+		if isdir:
 			data = data + '/'
 			display = display + '/'
 		
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''Benchmarks for mdshell'''
+
+import argparse
+import base64
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Everything the shell does before showing its first prompt. The prompt itself needs a terminal,
+# so it is left out.
+_startup_code = 'import mdshell; mdshell.init_commands(); mdshell.ShellState()'
+
+def _run_startup(extra_args: list) -> subprocess.CompletedProcess:
+	'''Runs the shell's startup code in a fresh interpreter'''
+	return subprocess.run([sys.executable] + extra_args + ['-c', _startup_code],
+		cwd=os.path.dirname(os.path.realpath(__file__)), capture_output=True, text=True)
+
+
+def bench_startup(options: argparse.Namespace):
+	'''Reports the time to first prompt and the imports which take up most of it'''
+	best = None
+	for _ in range(options.rounds):
+		start = time.perf_counter()
+		result = _run_startup([])
+		elapsed = time.perf_counter() - start
+		if result.returncode:
+			print(result.stderr, file=sys.stderr)
+			sys.exit(1)
+		best = elapsed if best is None else min(best, elapsed)
+
+	# -X importtime writes a line to stderr for each module imported in the form
+	# `import time: <self us> | <cumulative us> | <module>`. Nested imports are indented.
+	result = _run_startup(['-X', 'importtime'])
+	imports = list()
+	for line in result.stderr.splitlines():
+		if not line.startswith('import time:'):
+			continue
+		parts = line[len('import time:'):].split('|')
+		if len(parts) != 3 or not parts[0].strip().isdigit():
+			continue
+		imports.append((int(parts[0]), int(parts[1]), parts[2].rstrip()))
+
+	toplevel = [ item for item in imports if not item[2].startswith('  ') ]
+	print(f"Time to first prompt: {best * 1000:.1f} ms (best of {options.rounds}, including "
+		"interpreter startup)")
+	print(f"Modules imported: {len(imports)}, total import time: "
+		f"{sum([ item[1] for item in toplevel ]) / 1000:.1f} ms\n")
+
+	print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+	imports.sort(key=lambda x: x[1], reverse=True)
+	for selftime, cumulative, name in imports[:options.top]:
+		print(f"{cumulative / 1000:>14.1f}{selftime / 1000:>10.1f}  {name.strip()}")
+
+
+# The tokenizer BaseCommand used before shellbase.tokenize(), for comparison
+_legacy_splitter = re.compile(r'\"(?:\%\"|[^\"])*\"|\"[^\"]*\"|[^\s\"]+')
+
+def _legacy_tokenize(command: str):
+	raw_tokens = re.findall(_legacy_splitter, command.strip())
+	if raw_tokens:
+		del raw_tokens[0]
+	
+	tokens = list()
+	args = dict()
+	for i in range(len(raw_tokens)):
+		token = raw_tokens[i].strip('"').replace('%"','"')
+		if '=' in token:
+			parts = token.split('=', 1)
+			if parts[0]:
+				args[parts[0]] = parts[1]
+				continue
+		tokens.append(token)
+	return tokens, args
+
+
+def _tokenizer_cases(size: int) -> list:
+	'''Returns a list of names and command lines to tokenize. Blobs are about size bytes.'''
+	blob = base64.b85encode(os.urandom(size * 4 // 5)).decode()
+	return [
+		('short', 'myinfo set Mensago.0.Domain example.com'),
+		('named args', 'register example.com "Corbin Simons" ' +
+			' '.join([ f'key{i}="value {i}"' for i in range(50) ])),
+		('key blob', f'myinfo set Keys.0.Value CURVE25519:{blob}'),
+		('quoted blob', f'myinfo set Notes "{blob.replace(chr(34), "%" + chr(34))}"'),
+		('password arg', f'register example.com none password={blob}'),
+	]
+
+
+def bench_tokenizer(options: argparse.Namespace):
+	'''Reports the speed of shellbase.tokenize() against the tokenizer it replaced'''
+	import shellbase
+
+	print(f"{'case':<14}{'length':>10}{'legacy lines/s':>16}{'lines/s':>12}{'speedup':>9}")
+	for name, line in _tokenizer_cases(options.size * 1024):
+		times = list()
+		for func in [ _legacy_tokenize, shellbase.tokenize ]:
+			best = None
+			for _ in range(options.rounds):
+				start = time.perf_counter()
+				for _ in range(options.count):
+					func(line)
+				elapsed = time.perf_counter() - start
+				best = elapsed if best is None else min(best, elapsed)
+			times.append(best)
+		print(f"{name:<14}{len(line):>10}{options.count / times[0]:>16,.0f}"
+			f"{options.count / times[1]:>12,.0f}{times[0] / times[1]:>8.2f}x")
+
+
+def handle_arguments() -> argparse.Namespace:
+	'''Parses the command-line arguments'''
+	parser = argparse.ArgumentParser(description='Benchmarks for mdshell')
+	subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+	startparser = subparsers.add_parser('startup',
+		help='time to first prompt, with a breakdown from python -X importtime')
+	startparser.add_argument('--rounds', type=int, default=5, help='best of this many rounds')
+	startparser.add_argument('--top', type=int, default=15,
+		help='number of slowest imports to list')
+	startparser.set_defaults(func=bench_startup)
+
+	tokparser = subparsers.add_parser('tokenizer',
+		help='command lines per second split by the command-line tokenizer')
+	tokparser.add_argument('--size', type=int, default=64, help='size of pasted blobs in KB')
+	tokparser.add_argument('--count', type=int, default=200,
+		help='number of times to tokenize each line per round')
+	tokparser.add_argument('--rounds', type=int, default=3, help='best of this many rounds')
+	tokparser.set_defaults(func=bench_tokenizer)
+
+	return parser.parse_args()
+
+
+if __name__ == '__main__':
+	options = handle_arguments()
+	options.func(options)
+	sys.exit(0)
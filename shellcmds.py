@@ -2,7 +2,6 @@
 # pylint: disable=unused-argument,too-many-branches
 # import collections
 from getpass import getpass
-from glob import glob
 import os
 import platform
 import re
@@ -13,27 +12,23 @@ from prompt_toolkit import print_formatted_text, HTML
 from retval import RetVal, ErrBadData, ErrEmptyData, ErrFilesystemError, ErrNotFound, ErrOK, \
 	ErrUnimplemented
 
-import pymensago.errorcodes as errorcodes
-
+import commandaccess
 import helptext
-import server_reset
-from shellbase import BaseCommand, gShellCommands, ShellState
+from shellbase import BaseCommand, PrefixIndex, ShellState, get_dir_completions
 import shellhelp
 
 class CommandEmpty(BaseCommand):
 	'''Special command just to handle blanks'''
 
-	def __init__(self):
-		super().__init__()
-		self.name = ''
+	__slots__ = ()
+	name = ''
 
 
 class CommandUnrecognized(BaseCommand):
 	'''Special class for handling anything the shell doesn't support'''
 
-	def __init__(self):
-		super().__init__()
-		self.name = 'unrecognized'
+	__slots__ = ()
+	name = 'unrecognized'
 
 	def execute(self, shellstate: ShellState) -> RetVal:
 		return RetVal(ErrNotFound, 'Unknown command')
@@ -41,12 +36,11 @@ class CommandUnrecognized(BaseCommand):
 
 class CommandChDir(BaseCommand):
 	'''Change directories'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'chdir'
-		self.help = 'Usage: cd <location>\nChanges to the specified directory\n\n' + \
-						'Aliases: cd'
-		self.description = 'change directory/location'
+	__slots__ = ()
+	name = 'chdir'
+	help = 'Usage: cd <location>\nChanges to the specified directory\n\n' + \
+					'Aliases: cd'
+	description = 'change directory/location'
 
 	def get_aliases(self) -> dict:
 		return { 'cd': 'chdir' }
@@ -73,36 +67,51 @@ class CommandChDir(BaseCommand):
 
 	def autocomplete(self, tokens: list, shellstate: ShellState):
 		if len(tokens) == 1:
-			out_data = list()
-			
-			quote_mode = bool(tokens[0][0] == '"')
-			if quote_mode:
-				items = glob(tokens[0][1:] + '*')
-			else:
-				items = glob(tokens[0] + '*')
-			
-			for item in items:
-				if not os.path.isdir(item):
-					continue
-
-				display = item
-				if quote_mode or ' ' in item:
-					data = '"' + item + '"'
-				else:
-					data = item
-				out_data.append([data,display])
-					
-			return out_data
+			return get_dir_completions(tokens[0])
 		return list()
 
 
+class CommandConnections(BaseCommand):
+	'''Shows the server connections kept open by the shell'''
+	__slots__ = ()
+	name = 'connections'
+	help = helptext.connections_cmd
+	description = 'List open server connections'
+
+	def validate(self, shellstate: ShellState) -> RetVal:
+		if len(self.tokens) > 1 or (self.tokens and self.tokens[0].casefold() != 'close'):
+			return RetVal(ErrBadData, self.help)
+		return RetVal()
+
+	def execute(self, shellstate: ShellState) -> RetVal:
+		if self.tokens:
+			shellstate.pool.close()
+			return RetVal(ErrOK, 'All connections closed')
+		
+		stats = shellstate.pool.stats()
+		out = list()
+		for domain, info in stats['connections'].items():
+			if info['busy']:
+				state = 'busy'
+			elif info['connected']:
+				state = f"idle {info['idle']:.0f}s"
+			else:
+				state = 'not connected'
+			out.append(f"{domain or '(none)':<32} {state}")
+		if not out:
+			out.append('No open connections')
+		out.append(f"Reused: {stats['hits']}  New: {stats['misses']}  "
+			f"Closed: {stats['evictions']}")
+		
+		return RetVal(ErrOK, '\n'.join(out))
+
+
 class CommandExit(BaseCommand):
 	'''Exit the program'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'exit'
-		self.help = 'Usage: exit\nCloses the connection and exits the shell.'
-		self.description = 'Exits the shell'
+	__slots__ = ()
+	name = 'exit'
+	help = 'Usage: exit\nCloses the connection and exits the shell.'
+	description = 'Exits the shell'
 
 	def get_aliases(self) -> dict:
 		return { "x":"exit", "q":"exit" }
@@ -113,12 +122,11 @@ class CommandExit(BaseCommand):
 
 class CommandHelp(BaseCommand):
 	'''Implements the help system'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'help'
-		self.help = 'Usage: help <command>\nProvides information on a command.\n\n' + \
-						'Aliases: ?'
-		self.description = 'Show help on a command'
+	__slots__ = ()
+	name = 'help'
+	help = 'Usage: help <command>\nProvides information on a command.\n\n' + \
+					'Aliases: ?'
+	description = 'Show help on a command'
 
 	def get_aliases(self) -> dict:
 		return { "?":"help" }
@@ -134,19 +142,40 @@ class CommandHelp(BaseCommand):
 			out.extend(sorted(shellhelp.gettopiclist()))
 			return RetVal(ErrOK, '\n'.join(out))
 		
-		if topic in gShellCommands:
-			return RetVal(ErrOK, gShellCommands[self.tokens[0]].help)
+		cmd = commandaccess.get_command(topic)
+		if cmd.name not in ['', 'unrecognized']:
+			return RetVal(ErrOK, cmd.help)
 			
 		return RetVal(ErrOK, shellhelp.gettopic(topic))
 
 
+class CommandJobs(BaseCommand):
+	'''Lists background jobs'''
+	__slots__ = ()
+	name = 'jobs'
+	help = helptext.jobs_cmd
+	description = 'List background jobs'
+
+	def execute(self, shellstate: ShellState) -> RetVal:
+		if not shellstate.jobs:
+			return RetVal(ErrOK, 'No background jobs')
+		
+		out = list()
+		for jobid in sorted(shellstate.jobs.keys()):
+			job = shellstate.jobs[jobid]
+			out.append(f"[{job.id}] {job.state():<8} {job.cmdline}")
+			if job.status is not None:
+				del shellstate.jobs[jobid]
+		
+		return RetVal(ErrOK, '\n'.join(out))
+
+
 class CommandListDir(BaseCommand):
 	'''Performs a directory listing by calling the shell'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'ls'
-		self.help = 'Usage: as per bash ls command or Windows dir command'
-		self.description = 'list directory contents'
+	__slots__ = ()
+	name = 'ls'
+	help = 'Usage: as per bash ls command or Windows dir command'
+	description = 'list directory contents'
 
 	def get_aliases(self) -> dict:
 		return { "dir":"ls" }
@@ -176,41 +205,17 @@ class CommandListDir(BaseCommand):
 
 	def autocomplete(self, tokens: list, shellstate: ShellState):
 		if len(tokens) == 1:
-			out_data = list()
-			
-			if tokens[0][0] == '"':
-				quote_mode = True
-			else:
-				quote_mode = False
-			
-			if quote_mode:
-				items = glob(tokens[0][1:] + '*')
-			else:
-				items = glob(tokens[0] + '*')
-			
-			for item in items:
-				if not os.path.isdir(item):
-					continue
-
-				display = item
-				if quote_mode or ' ' in item:
-					data = '"' + item + '"'
-				else:
-					data = item
-				out_data.append([data,display])
-					
-			return out_data
+			return get_dir_completions(tokens[0])
 		return list()
 
 
 class CommandProfile(BaseCommand):
 	'''User profile management command'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'profile'
-		self.help = helptext.profile_cmd
-		self.description = 'Manage profiles.'
-		self.illegal_pattern = re.compile('''[<>:"'\/\\|?*\s]''')
+	__slots__ = ()
+	name = 'profile'
+	help = helptext.profile_cmd
+	description = 'Manage profiles.'
+	illegal_pattern = re.compile('''[<>:"'\/\\|?*\s]''')
 	
 	def validate(self, shellstate: ShellState) -> RetVal:
 		if not len(self.tokens):
@@ -256,6 +261,12 @@ class CommandProfile(BaseCommand):
 	def execute(self, shellstate: ShellState) -> RetVal:
 		verb = self.args['verb']
 		
+		# Server sessions are logged in with the active profile and have their own copy of it, so
+		# they are closed when it could change. So are myinfo's cached field slots.
+		if verb in [ 'delete', 'set', 'rename' ]:
+			shellstate.pool.close()
+			shellstate.field_slots.clear()
+		
 		if verb == 'get':
 			status = shellstate.client.pman.get_active_profile()
 			if status.error():
@@ -319,10 +330,8 @@ class CommandProfile(BaseCommand):
 		if len(tokens) < 1:
 			return list()
 
-		verbs = [ 'create', 'delete', 'list', 'rename' ]
-		if len(tokens) == 1 and tokens[0] not in verbs:
-			out_data = [i for i in verbs if i.startswith(tokens[0])]
-			return out_data
+		if len(tokens) == 1:
+			return [ [verb, verb] for verb in _profile_verbs.matches(tokens[0].casefold()) ]
 		
 		# groups = shellstate.client.pman.get_profiles()
 		# if len(tokens) == 2 and tokens[1] not in groups:
@@ -332,13 +341,15 @@ class CommandProfile(BaseCommand):
 		return list()
 
 
+_profile_verbs = PrefixIndex([ 'create', 'delete', 'get', 'list', 'rename', 'set', 'setdefault' ])
+
+
 class CommandShell(BaseCommand):
 	'''Perform shell commands'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'shell'
-		self.help = helptext.shell_cmd
-		self.description = 'Run a shell command'
+	__slots__ = ()
+	name = 'shell'
+	help = helptext.shell_cmd
+	description = 'Run a shell command'
 
 	def get_aliases(self) -> dict:
 		'''Return aliases for the command'''
@@ -356,11 +367,10 @@ class CommandShell(BaseCommand):
 
 class CommandResetDB(BaseCommand):
 	'''Dev command to reset the server database'''
-	def __init__(self):
-		super().__init__()
-		self.name = 'resetdb'
-		self.help = helptext.resetdb_cmd
-		self.description = 'DEVELOPER: Completely resets the local Mensago database'
+	__slots__ = ()
+	name = 'resetdb'
+	help = helptext.resetdb_cmd
+	description = 'DEVELOPER: Completely resets the local Mensago database'
 	
 	def execute(self, shellstate: ShellState) -> RetVal:
 		choice = input("This will delete ALL DATA in the local database.\n"
@@ -369,6 +379,9 @@ class CommandResetDB(BaseCommand):
 		if choice not in ['y', 'Y']:
 			return RetVal()
 
+		# server_reset needs psycopg2 and a few other modules nothing else uses, so it is only
+		# loaded when needed
+		import server_reset
 		data = server_reset.reset()
 
 		return RetVal(ErrOK, f"Administrator workspace: {data['admin']}\n"
@@ -2,10 +2,12 @@ import inspect
 import os
 import platform
 import shutil
+import threading
 import time
 
 from retval import RetVal
 
+import commandaccess
 import shellbase
 import shellcmds
 
@@ -66,6 +68,62 @@ def test_parsing():
 	assert 'bar' in cmd.args and cmd.args['bar'] == 'spam eggs', \
 		f"{funcname()}: #5 failed to parse named arguments"
 
+	# Subtest #6: Escaped quote at the end of a quoted argument
+	status = cmd.set('cmd "foo %"bar%""')
+	assert not status.error(), f"{funcname()}: #6 failed to tokenize quoted arguments"
+	assert cmd.tokens == ['foo "bar"'], f"{funcname()}: #6 failed to handle quote escaping"
+
+
+def test_invocations():
+	'''Ensures each command invocation has its own arguments'''
+	commandaccess.init_commands()
+	first = commandaccess.get_command('help')
+	second = commandaccess.get_command('?')
+	assert first is not second, f"{funcname()}: get_command() returned a shared instance"
+
+	first.set('help foo a=b')
+	second.set('help bar')
+	assert first.tokens == ['foo'] and first.args == {'a':'b'}, \
+		f"{funcname()}: arguments changed by another invocation"
+	assert not hasattr(first, '__dict__'), f"{funcname()}: command instance has a __dict__"
+
+
+def test_prefix_index():
+	'''Tests PrefixIndex lookups'''
+	index = shellbase.PrefixIndex(['set', 'get', 'setdefault', 'sh', 'shell'])
+	assert index.matches('se') == ['set', 'setdefault'], f"{funcname()}: bad prefix matches"
+	assert index.matches('') == index.words, f"{funcname()}: empty prefix didn't match all"
+	assert not index.matches('z'), f"{funcname()}: matched nonexistent prefix"
+
+	index.add('seq')
+	index.add('set')
+	assert index.words == ['get', 'seq', 'set', 'setdefault', 'sh', 'shell'], \
+		f"{funcname()}: add() didn't keep the index sorted and unique"
+
+
+def test_path_completions():
+	'''Tests cached path completion'''
+	test_folder = setup_test(funcname())
+	os.mkdir(os.path.join(test_folder, 'subdir'))
+	with open(os.path.join(test_folder, 'subfile'), 'w') as fhandle:
+		fhandle.write('test')
+	
+	prefix = os.path.join(test_folder, 'sub')
+	out = shellbase.get_path_completions(prefix)
+	assert sorted(out) == [[prefix + 'dir', True], [prefix + 'file', False]], \
+		f"{funcname()}: bad completions {out}"
+	
+	out = shellbase.get_dir_completions(prefix)
+	assert out == [[prefix + 'dir', prefix + 'dir']], f"{funcname()}: bad dir completions {out}"
+
+	# The cached listing must be replaced once the directory changes. The modification time is
+	# set explicitly because some filesystems have coarse timestamps.
+	os.mkdir(os.path.join(test_folder, 'subdir2'))
+	stat = os.stat(test_folder)
+	os.utime(test_folder, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+	out = shellbase.get_path_completions(prefix, True)
+	assert len(out) == 2, f"{funcname()}: stale listing after directory change: {out}"
+
 
 def test_chdir():
 	'''Basic tests for chdir'''
@@ -113,7 +171,148 @@ def test_listdir():
 		status = cmd.execute(shellstate)
 		assert not status.error(), f"{funcname()}: execute('{dir}') failed: {status.error()}"
 
+
+def test_jobs():
+	'''Tests job tracking and the jobs command'''
+	shellstate = shellbase.ShellState()
+
+	running = shellbase.Job(1, 'login')
+	finished = shellbase.Job(2, 'preregister none')
+	finished.status = RetVal()
+	shellstate.jobs = { 1: running, 2: finished }
+
+	assert running.state() == 'running', f"{funcname()}: wrong state for a running job"
+	assert finished.state() == 'done', f"{funcname()}: wrong state for a finished job"
+
+	cmd = shellcmds.CommandJobs()
+	status = cmd.set('jobs')
+	assert not status.error(), f"{funcname()}: set() failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: execute() failed: {status.error()}"
+	assert 'preregister none' in status.info(), f"{funcname()}: finished job not listed"
+
+	# Finished jobs are only listed once
+	assert list(shellstate.jobs.keys()) == [1], f"{funcname()}: finished job not removed"
+
+
+class FakeConnection:
+	'''Stands in for a ServerConnection in the connection pool tests'''
+	def __init__(self):
+		self.connected = True
+	
+	def is_connected(self) -> bool:
+		return self.connected
+	
+	def disconnect(self):
+		self.connected = False
+
+
+class FakeClient:
+	'''Stands in for a MensagoClient in the connection pool tests'''
+	def __init__(self):
+		self.conn = FakeConnection()
+	
+	def disconnect(self):
+		self.conn.disconnect()
+
+
+def test_connection_pool():
+	'''Tests reuse and eviction of pooled server sessions'''
+	shellstate = shellbase.ShellState()
+	pool = shellstate.pool
+	pool.max_size = 2
+
+	sessions = list()
+	for domain in [ 'example.com', 'example.net' ]:
+		session = pool.acquire(domain)
+		session.state = shellbase.ShellState()
+		session.state._client = FakeClient()
+		sessions.append(session)
+	assert pool.misses == 2, f"{funcname()}: new sessions not counted as misses"
+
+	assert pool.acquire('example.net') is session, f"{funcname()}: session not reused"
+	assert pool.hits == 1, f"{funcname()}: reuse not counted as a hit"
+
+	# example.com is the least recently used, so adding a third session closes it
+	pool.acquire('example.org')
+	assert 'example.com' not in pool.sessions, f"{funcname()}: excess session not evicted"
+	assert pool.evictions == 1, f"{funcname()}: eviction not counted"
+
+	pool.sessions['example.net'].last_used -= 1000
+	pool.acquire('example.org')
+	assert 'example.net' not in pool.sessions, f"{funcname()}: idle session not evicted"
+
+	pool.evict('example.org')
+	assert 'example.org' not in pool.sessions, f"{funcname()}: session not evicted"
+	pool.acquire('example.org')
+
+	cmd = shellcmds.CommandConnections()
+	status = cmd.set('connections')
+	assert not status.error(), f"{funcname()}: set() failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: execute() failed: {status.error()}"
+	assert 'example.org' in status.info(), f"{funcname()}: open session not listed"
+
+	status = cmd.set('connections close')
+	assert not status.error(), f"{funcname()}: set() failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: execute() failed: {status.error()}"
+	assert not pool.sessions, f"{funcname()}: sessions not closed"
+
+	for session in sessions:
+		session.executor.shutdown(wait=True)
+		assert not session.state._client.conn.connected, \
+			f"{funcname()}: evicted session not disconnected"
+
+
+def test_session_jobs():
+	'''Tests that a session runs its commands in order with a client of its own'''
+	
+	class RecordCommand(shellbase.BaseCommand):
+		__slots__ = ()
+		def execute(self, shellstate: shellbase.ShellState) -> RetVal:
+			shellstate.aliases[len(shellstate.aliases)] = self.rawcmd
+			return RetVal().set_value('thread', threading.get_ident())
+
+	shellstate = shellbase.ShellState()
+	session = shellstate.pool.acquire('example.com')
+	futures = list()
+	for i in range(5):
+		cmd = RecordCommand()
+		cmd.set(f"record {i}")
+		futures.append(session.submit(cmd))
+	
+	threads = set([ f.result()['thread'] for f in futures ])
+	assert len(threads) == 1 and threading.get_ident() not in threads, \
+		f"{funcname()}: session commands not run on the session's thread"
+	assert list(session.state.aliases.values()) == [ f"record {i}" for i in range(5) ], \
+		f"{funcname()}: session commands run out of order"
+	assert session.state is not shellstate, f"{funcname()}: session shares the shell's state"
+	shellstate.pool.close()
+
+
+def test_command_table():
+	'''Ensures the command table matches the commands themselves'''
+	commandaccess.init_commands()
+	for name, entry in commandaccess._command_table.items():
+		cmd = commandaccess.get_command(name)
+		assert cmd.name == name, f"{funcname()}: {name} created command {cmd.name}"
+		assert cmd.description == entry[3], f"{funcname()}: {name} description mismatch"
+		assert sorted(cmd.get_aliases().keys()) == sorted(entry[2]), \
+			f"{funcname()}: {name} alias mismatch"
+		for alias in entry[2]:
+			assert type(commandaccess.get_command(alias)) is type(cmd), \
+				f"{funcname()}: alias {alias} didn't resolve to {name}"
+
+
 if __name__ == '__main__':
 	test_parsing()
+	test_invocations()
+	test_prefix_index()
+	test_path_completions()
 	test_chdir()
 	test_listdir()
+	test_jobs()
+	test_connection_pool()
+	test_session_jobs()
+	test_command_table()
@@ -1,9 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+import csv
 import inspect
+import json
 import os
 import shutil
 import time
 
-from pymensago.userinfo import load_user_field
+from pymensago.userinfo import load_user_field, save_user_field
 import pymensago.userprofile as userprofile
 from pymensago.utils import MAddress
 from retval import ErrNotFound
@@ -186,6 +189,194 @@ def test_myinfo_check():
 	assert not status.error(), f"{funcname()}: check: {status.error()}"
 
 
+def test_myinfo_check_all():
+	'''Tests checking the contact information of all profiles'''
+	test_folder = setup_test(funcname())
+	shellstate = shellbase.ShellState(test_folder)
+	data = server_reset.reset()
+	status = shellstate.client.redeem_regcode(MAddress('admin/example.com'), data['admin_regcode'],
+		'MyS3cretPassw*rd')
+	assert not status.error(), f"{funcname()}: admin regcode failed: {status.error()}"
+
+	reportpath = os.path.join(test_folder, 'report.csv')
+	cmd = iscmds.CommandMyInfo()
+	status = cmd.set(f"myinfo check all jobs=2 report={reportpath}")
+	assert not status.error(), f"{funcname()}: set failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert not status.error(), f"{funcname()}: validate failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	
+	profiles = shellstate.client.pman.get_profiles()
+	assert len(status['results']) == len(profiles), f"{funcname()}: not all profiles were checked"
+	for result in status['results']:
+		assert not result['error'], \
+			f"{funcname()}: profile {result['profile']} not checked: {result['error']}"
+	assert os.path.exists(reportpath), f"{funcname()}: report not saved"
+
+	status = cmd.set('myinfo check all jobs=0')
+	assert not status.error(), f"{funcname()}: set failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert status.error(), f"{funcname()}: validate failed to catch bad job count"
+
+
+def test_myinfo_import_export():
+	'''Tests bulk import and export of contact information'''
+	test_folder = setup_test(funcname())
+	shellstate = shellbase.ShellState(test_folder)
+	data = server_reset.reset()
+	status = shellstate.client.redeem_regcode(MAddress('admin/example.com'), data['admin_regcode'],
+		'MyS3cretPassw*rd')
+	assert not status.error(), f"{funcname()}: admin regcode failed: {status.error()}"
+
+	contact = {
+		'GivenName': 'Corbin',
+		'FamilyName': 'Simons',
+		'Nicknames': [ 'Test1', 'Test2' ],
+		'Mensago': [ { 'Label': 'Primary', 'Workspace': data['admin'], 'Domain': 'example.com' } ],
+	}
+	importpath = os.path.join(test_folder, 'contact.json')
+	with open(importpath, 'w') as fhandle:
+		json.dump(contact, fhandle)
+	
+	cmd = iscmds.CommandMyInfo()
+	for entry in [ 'myinfo set Title Tester', 'myinfo set Nicknames.2 Stale',
+			f"myinfo import {importpath}" ]:
+		status = cmd.set(entry)
+		assert not status.error(), f"{funcname()}: command `{entry}` failed: {status.error()}"
+		status = cmd.validate(shellstate)
+		assert not status.error(), f"{funcname()}: validate('{entry}') failed: {status.error()}"
+		status = cmd.execute(shellstate)
+		assert not status.error(), f"{funcname()}: execute('{entry}') failed: {status.error()}"
+
+	status = shellstate.client.pman.get_active_profile()
+	assert not status.error(), f"{funcname()}: failed to get active profile: {status.error()}"
+	profile = status['profile']
+	status = load_user_field(profile.db, 'Nicknames.1')
+	assert not status.error() and status['value'] == 'Test2', \
+		f"{funcname()}: import didn't save list fields"
+	status = load_user_field(profile.db, 'Nicknames.2')
+	assert status.error() == ErrNotFound, f"{funcname()}: import didn't replace whole fields"
+	status = load_user_field(profile.db, 'Title')
+	assert not status.error() and status['value'] == 'Tester', \
+		f"{funcname()}: import didn't keep fields missing from the file"
+
+	# vCards can't hold the workspace fields, so importing one must keep them
+	vcardpath = os.path.join(test_folder, 'contact.vcf')
+	with open(vcardpath, 'w') as fhandle:
+		fhandle.write('BEGIN:VCARD\r\nVERSION:4.0\r\nFN:Corbin Simons\r\nEND:VCARD\r\n')
+	status = cmd.set(f"myinfo import {vcardpath}")
+	assert not status.error(), f"{funcname()}: vCard import.set failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert not status.error(), f"{funcname()}: vCard import.validate failed: {status.info()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: vCard import.execute failed: {status.error()}"
+	status = load_user_field(profile.db, 'Mensago.0.Workspace')
+	assert not status.error() and status['value'] == data['admin'], \
+		f"{funcname()}: vCard import removed the workspace fields"
+
+	# Noncompliant files are rejected before anything is written
+	del contact['Mensago'][0]['Domain']
+	contact['GivenName'] = 'Rejected'
+	with open(importpath, 'w') as fhandle:
+		json.dump(contact, fhandle)
+	status = cmd.set(f"myinfo import {importpath}")
+	assert not status.error(), f"{funcname()}: bad import.set failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert status.error() and 'missing' in status, \
+		f"{funcname()}: import.validate failed to catch noncompliance"
+	status = load_user_field(profile.db, 'GivenName')
+	assert status['value'] == 'Corbin', f"{funcname()}: rejected import changed fields"
+
+	exportpath = os.path.join(test_folder, 'export.json')
+	status = cmd.set(f"myinfo export {exportpath}")
+	assert not status.error(), f"{funcname()}: export.set failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert not status.error(), f"{funcname()}: export.validate failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: export.execute failed: {status.error()}"
+	with open(exportpath, 'r') as fhandle:
+		exported = json.load(fhandle)
+	assert exported['Nicknames'] == [ 'Test1', 'Test2' ], \
+		f"{funcname()}: export has wrong data: {exported}"
+
+
+def test_myinfo_fields():
+	'''Tests field specifier validation and completion'''
+	for field in [ 'GivenName', 'Nicknames.0', 'Phone.12.Label', 'Annotations.Mensago.0.Domain' ]:
+		assert iscmds._is_field_valid(field), f"{funcname()}: valid field {field} rejected"
+	
+	for field in [ 'Annotations', 'Nicknames', 'Nicknames.x', 'Phone.0', 'Phone.-1.Label',
+			'GivenName.0', 'Phone.0.Bogus', 'Annotations.Annotations.GivenName' ]:
+		assert not iscmds._is_field_valid(field), f"{funcname()}: invalid field {field} accepted"
+	
+	out = iscmds._get_field_completions('Ph')
+	assert out == [ 'Phone.', 'Photo.' ], f"{funcname()}: bad field name completions {out}"
+	
+	out = iscmds._get_field_completions('Phone.', { 'Phone': [0, 2] })
+	assert out == [ 'Phone.0.', 'Phone.2.', 'Phone.3.' ], \
+		f"{funcname()}: bad item index completions {out}"
+	
+	out = iscmds._get_field_completions('Annotations.Phone.1.La')
+	assert out == [ 'Annotations.Phone.1.Label' ], f"{funcname()}: bad subfield completions {out}"
+
+
+def test_myinfo_slots():
+	'''Tests that field slots for completion are read safely from the completion thread'''
+	test_folder = setup_test(funcname())
+	shellstate = shellbase.ShellState(test_folder)
+
+	# Completion must never be the thing which creates the client
+	assert iscmds._get_field_slots(shellstate) == dict(), \
+		f"{funcname()}: slots returned without a client"
+	assert shellstate.loaded_client is None, f"{funcname()}: completion created the client"
+
+	cmd = iscmds.CommandMyInfo()
+	for entry in [ 'myinfo set Nicknames.0 Test1', 'myinfo set Nicknames.3 Test2',
+			'myinfo set Phone.1.Value 555-555-1234' ]:
+		status = cmd.set(entry)
+		assert not status.error(), f"{funcname()}: set('{entry}') failed: {status.error()}"
+		status = cmd.validate(shellstate)
+		assert not status.error(), f"{funcname()}: validate('{entry}') failed: {status.error()}"
+		status = cmd.execute(shellstate)
+		assert not status.error(), f"{funcname()}: execute('{entry}') failed: {status.error()}"
+	
+	with ThreadPoolExecutor(1) as pool:
+		slots = pool.submit(iscmds._get_field_slots, shellstate).result()
+	assert slots.get('Nicknames') == [0, 3] and slots.get('Phone') == [1], \
+		f"{funcname()}: wrong slots from the completion thread: {slots}"
+
+	# A background job changes the profile through a client of its own, and its finish() hook
+	# resets the shell's client, which must also drop the cached slots
+	profile = shellstate.client.pman.get_active_profile()['profile']
+	status = save_user_field(profile.db, 'Nicknames.5', 'Test3')
+	assert not status.error(), f"{funcname()}: failed to save field: {status.error()}"
+	shellstate.reset_client()
+	assert iscmds._get_field_slots(shellstate) == dict(), \
+		f"{funcname()}: slots returned after the client was reset"
+
+	# The next foreground command loads the client again
+	shellstate.client.pman.get_active_profile()
+	slots = iscmds._get_field_slots(shellstate)
+	assert slots.get('Nicknames') == [0, 3, 5], f"{funcname()}: stale slots after reset: {slots}"
+
+
+def test_check_contact_fields():
+	'''Tests the compliance checker without a profile database'''
+	status = iscmds.check_contact_fields([ 'GivenName', 'Mensago.0.Label', 'Mensago.0.Workspace',
+		'Mensago.0.Domain', 'Annotations.Phone.0.Value' ])
+	assert not status.error(), f"{funcname()}: compliant fields rejected: {status['errors']}"
+	
+	status = iscmds.check_contact_fields([ 'Bogus', 'Mensago.0.Label', 'Mensago.1.Workspace',
+		'Mensago.1.Domain', 'Keys.0.Value' ])
+	assert status.error(), f"{funcname()}: failed to catch noncompliance"
+	errors = status['errors']
+	assert errors['invalid'] == [ 'Bogus' ], f"{funcname()}: wrong invalid fields"
+	assert errors['missing'] == [ 'Workspace missing from Mensago item',
+		'Domain missing from Mensago item', 'Label missing from Mensago item',
+		'Label missing from Keys item', 'KeyType missing from Keys item',
+		'KeyHash missing from Keys item' ], f"{funcname()}: wrong missing fields {errors['missing']}"
+
+
 def test_preregister_plus():
 	'''Tests the complete preregistration process each of the several ways'''
 	test_folder = setup_test(funcname())
@@ -244,6 +435,78 @@ def test_preregister_plus():
 	shellstate.client.disconnect()
 
 
+def test_preregister_batch():
+	'''Tests preregistration of accounts listed in a file'''
+	test_folder = setup_test(funcname())
+	shellstate = shellbase.ShellState(test_folder)
+
+	data = server_reset.reset()
+	status = shellstate.client.redeem_regcode(MAddress('admin/example.com'), data['admin_regcode'],
+		'MyS3cretPassw*rd')
+	assert not status.error(), f"{funcname()}: admin regcode failed: {status.error()}"
+	status = shellstate.client.login(MAddress('admin/example.com'))
+	assert not status.error(), f"{funcname()}: Failed to log in as admin: " \
+		f"{status.error()} / {status.info()}"
+
+	inpath = os.path.join(test_folder, 'users.csv')
+	with open(inpath, 'w') as fhandle:
+		fhandle.write('uid,domain\ncsimons,example.com\nrbrannan,\nnone,\n')
+	outpath = os.path.join(test_folder, 'regcodes.jsonl')
+
+	cmd = iscmds.CommandPreregister()
+	entry = f"preregister from={inpath} out={outpath}"
+	status = cmd.set(entry)
+	assert not status.error(), f"{funcname()}: set('{entry}') failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert not status.error(), f"{funcname()}: validate('{entry}') failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: execute('{entry}') failed: {status.info()}"
+
+	with open(outpath, 'r') as fhandle:
+		results = [ json.loads(line) for line in fhandle ]
+	assert len(results) == 3, f"{funcname()}: wrong number of results saved"
+	assert [ r['uid'] for r in results[:2] ] == [ 'csimons', 'rbrannan' ], \
+		f"{funcname()}: results out of order"
+	for result in results:
+		assert result['wid'] and result['regcode'] and not result['error'], \
+			f"{funcname()}: incomplete result {result}"
+
+	# Several admin connections at once still give results in the order of the file
+	uids = [ f"user{i}" for i in range(20) ]
+	with open(inpath, 'w') as fhandle:
+		fhandle.write('uid\n' + '\n'.join(uids) + '\n')
+	outpath = os.path.join(test_folder, 'regcodes.csv')
+	entry = f"preregister from={inpath} out={outpath} jobs=4"
+	status = cmd.set(entry)
+	assert not status.error(), f"{funcname()}: set('{entry}') failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert not status.error(), f"{funcname()}: validate('{entry}') failed: {status.error()}"
+	status = cmd.execute(shellstate)
+	assert not status.error(), f"{funcname()}: execute('{entry}') failed: {status.info()}"
+	with open(outpath, 'r', newline='') as fhandle:
+		results = list(csv.DictReader(fhandle))
+	assert [ r['uid'] for r in results ] == uids, f"{funcname()}: parallel results out of order"
+	assert all([ r['regcode'] and not r['error'] for r in results ]), \
+		f"{funcname()}: parallel preregistration failed"
+
+	status = cmd.set(f"preregister from={inpath} jobs=0")
+	assert not status.error(), f"{funcname()}: set() failed: {status.error()}"
+	assert cmd.validate(shellstate).error(), f"{funcname()}: validate() accepted jobs=0"
+
+	# Files with bad or duplicate entries are rejected before anything is sent
+	with open(inpath, 'w') as fhandle:
+		fhandle.write('uid\ncsimons2\ncsimons2\nbad/user\n')
+	status = cmd.set(f"preregister from={inpath}")
+	assert not status.error(), f"{funcname()}: set() failed: {status.error()}"
+	status = cmd.validate(shellstate)
+	assert status.error(), f"{funcname()}: validate() accepted a bad file"
+	assert 'line 3' in status.info() and 'line 4' in status.info(), \
+		f"{funcname()}: bad lines not reported"
+
+	shellstate.client.logout()
+	shellstate.client.disconnect()
+
+
 def test_profile():
 	'''Tests the different profile command modes'''
 	test_folder = setup_test(funcname())
@@ -380,7 +643,13 @@ if __name__ == '__main__':
 	# test_login_logout()
 	test_myinfo()
 	test_myinfo_check()
+	test_myinfo_check_all()
+	test_myinfo_fields()
+	test_myinfo_slots()
+	test_check_contact_fields()
+	test_myinfo_import_export()
 	# test_preregister_plus()
+	# test_preregister_batch()
 	# test_profile()
 	# test_regcode()
 	# test_register()
@@ -5,180 +5,238 @@
 # Released under the terms of the MIT license
 # ©2019-2020 Jon Yoder <jon@yoder.cloud>
 
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+from itertools import islice
+import json
+import os
 import re
 import sys
+import tempfile
+import threading
+import time
 
-def AnTM2HTML(instr, fulldocument):
+import markupscan
+
+try:
+	import blake3
+except ImportError:
+	blake3 = None
+
+_conversion_map = {
+	'b' : '<span style="font-weight: bold;">',
+	'/b' : '</span>',
+	'i' : '<span style="font-style: italic;">',
+	'/i' : '</span>',
+	'u' : '<span style="text-decoration: underline;">',
+	'/u' : '</span>',
+	's' : '<span style="text-decoration: line-through;">',
+	'/s' : '</span>',
+	'quote' : '<blockquote>',
+	'/quote' : '</blockquote>',
+	'code' : '<pre>',
+	'/code' : '</pre>',
+	'li' : '<li>',
+	'/li' : '</li>',
+	'table' : '<table>',
+	'/table' : '</table>',
+	'row' : '<tr>',
+	'/row' : '</tr>',
+	'cell' : '<td>',
+	'/cell' : '</td>',
+	'sub' : '<sub>',
+	'/sub' : '</sub>',
+	'sup' : '<sup>',
+	'/sup' : '</sup>',
+	'/body' : '</body>',
+	'/style' : '</span>',
+	'/image' : '</figure>',
+	'/link' : '</a>',
+	'/olist' : '</ol>',
+	'/ulist' : '</ul>',
+	'/align' : '</div>'
+}
+
+# Within text, a line break on its own is converted to a <br /> tag. Line breaks which are part of
+# a larger run of whitespace, such as indentation, are left alone.
+_linebreak_pattern = re.compile(r'(?<!\s)\r?\n(?!\s)')
+
+# Tag contents are only split into attributes for tags which actually have them
+_attr_pattern = re.compile(r'([^\s=]+)="([^"]*)"|(\S+)')
+
+
+class AnTMError(Exception):
+	'''Raised when a document contains a malformed tag. token contains the text of the offending
+	tag and line is the line of the document on which it was found.'''
+	def __init__(self, msg: str, token: str, line=0):
+		super().__init__(msg)
+		self.token = token
+		self.line = line
+
+	def __str__(self):
+		if self.line:
+			return f"Line {self.line}: {self.args[0]}"
+		return self.args[0]
+
+
+def _parse_attributes(token: str, attrstr: str) -> dict:
+	'''Parses the attribute section of a tag into a dictionary'''
+	attrs = {}
+	for match in _attr_pattern.finditer(attrstr):
+		if match.group(3):
+			if match.group(3)[0] == '=':
+				raise AnTMError('Bad attribute name in tag %s' % token, token)
+			raise AnTMError('Improperly quoted attribute value in tag %s' % token, token)
+		if not match.group(2):
+			raise AnTMError('Bad attribute value in tag %s' % token, token)
+		attrs[match.group(1).casefold()] = match.group(2)
+	return attrs
+
+
+def _check_attributes(token: str, attrs: dict, allowed: tuple):
+	'''Ensures that a tag has no attributes except those allowed'''
+	for key in attrs:
+		if key not in allowed:
+			raise AnTMError('In tag "%s":\nUnrecognized attribute "%s".' % (token, key), token)
+
+
+def _convert_image(tag_name: str, token: str, attrs: dict) -> str:
+	'''Converts an [image] tag into a figure'''
+	if 'url' not in attrs:
+		raise AnTMError('Image tag missing required attribute "url": %s' % token, token)
+
+	out_tag = ['<figure><img', 'src="%s"' % attrs['url']]
+	if 'width' in attrs or 'height' in attrs:
+		out_tag.append('style="')
+		if 'width' in attrs:
+			out_tag.append('width: %s;' % attrs['width'])
+		if 'height' in attrs:
+			out_tag.append('height: %s;' % attrs['height'])
+		out_tag.append('"')
+
+	out_tag.append('>')
+	if 'caption' in attrs:
+		out_tag.append('<figcaption>%s</figcaption>' % attrs['caption'].replace(r'\u0034','"'))
+	return ' '.join(out_tag)
+
+
+def _convert_link(tag_name: str, token: str, attrs: dict) -> str:
+	'''Converts a [link] tag into an anchor'''
+	_check_attributes(token, attrs, ('name', 'url'))
+	if 'url' not in attrs:
+		raise AnTMError('Link tag missing required attribute "url": %s' % token, token)
+
+	out_tag = ['<a']
+	if 'name' in attrs:
+		out_tag.append('name="%s"' % attrs['name'])
+	out_tag.extend(['href="%s"' % attrs['url'], '>'])
+	return ' '.join(out_tag)
+
+
+def _convert_list(tag_name: str, token: str, attrs: dict) -> str:
+	'''Converts [ulist] and [olist] tags'''
+	if len(attrs) > 1:
+		raise AnTMError('Tag "list" only supports 1 optional attribute: style.', token)
+	_check_attributes(token, attrs, ('style',))
+
+	out_tag = [ '<' + tag_name[0:2] ]
+	if 'style' in attrs:
+		out_tag.append('style="list-style-type: %s"' % attrs['style'])
+	out_tag.append('>')
+	return ' '.join(out_tag)
+
+
+def _convert_align(tag_name: str, token: str, attrs: dict) -> str:
+	'''Converts an [align] tag into a div'''
+	if len(attrs) != 1:
+		raise AnTMError('Tag "align" only supports 1 required attribute: type.', token)
+	_check_attributes(token, attrs, ('type',))
+	return '<div style="text-align: %s">' % attrs['type']
+
+
+def _convert_style(tag_name: str, token: str, attrs: dict) -> str:
+	'''Converts a [style] tag into a span'''
+	_check_attributes(token, attrs, ('family', 'size', 'color'))
+
+	css = list()
+	if 'family' in attrs:
+		css.append('font-family: %s;' % attrs['family'])
+	if 'size' in attrs:
+		css.append('font-size: %spt;' % attrs['size'])
+	if 'color' in attrs:
+		css.append('color: %s;' % attrs['color'])
+	return '<span style="%s">' % ' '.join(css)
+
+
+# Handlers for the tags which take attributes
+_complex_tags = {
+	'image' : _convert_image,
+	'link' : _convert_link,
+	'ulist' : _convert_list,
+	'olist' : _convert_list,
+	'align' : _convert_align,
+	'style' : _convert_style,
+}
+
+
+def AnTM2HTML(instr, fulldocument, sink=None):
 	'''
-	This function takes in AnTM, the Mensago dialect of BBCode, and spits out HTML.
+	This function takes in AnTM, the Mensago dialect of BBCode, and returns HTML. If a file-like
+	object is passed in sink, the HTML is written to it instead and None is returned. Malformed
+	tags raise an AnTMError. The function keeps no state between calls, so it is safe to call from
+	multiple threads.
 	'''
-	conversionMap = {
-		'b' : '<span style="font-weight: bold;">',
-		'/b' : '</span>',
-		'i' : '<span style="font-style: italic;">',
-		'/i' : '</span>',
-		'u' : '<span style="text-decoration: underline;">',
-		'/u' : '</span>',
-		's' : '<span style="text-decoration: line-through;">',
-		'/s' : '</span>',
-		'quote' : '<blockquote>',
-		'/quote' : '</blockquote>',
-		'code' : '<pre>',
-		'/code' : '</pre>',
-		'li' : '<li>',
-		'/li' : '</li>',
-		'table' : '<table>',
-		'/table' : '</table>',
-		'row' : '<tr>',
-		'/row' : '</tr>',
-		'cell' : '<td>',
-		'/cell' : '</td>',
-		'sub' : '<sub>',
-		'/sub' : '</sub>',
-		'sup' : '<sup>',
-		'/sup' : '</sup>',
-		'/body' : '</body>',
-		'/style' : '</span>',
-		'/image' : '</figure>',
-		'/link' : '</a>',
-		'/olist' : '</ol>',
-		'/ulist' : '</ul>',
-		'/align' : '</div>'
-	}
-	
 	sanitized_text = instr.replace('<','&lt;').replace('>','&gt;')
-	
-	rawtokens = re.findall(r'\[\s*?[a-zA-Z0-9 /\"=%&?:;.\\]+?\s*?\]|\s+|[-\w]+|.+', sanitized_text)
 
-	tokens = []
+	out = io.StringIO() if sink is None else sink
+	write = out.write
 	if fulldocument:
-		tokens.append('<html><body>')
-	
-	for token in rawtokens:
-		if token[0] == '[':
-			# We have an AnTM token, so this will need translated
-			inside_tokens = re.findall(r'[\S]+=\"[^\"]+\"|\S+', token[1:-1])
-
-			if len(inside_tokens) == 1:
-				# use a lookup table to convert
-				tokens.append(conversionMap[inside_tokens[0]])
-				sys.stdout.write(conversionMap[inside_tokens[0]])
-			else:
-				# Do the translation semi-manually. This is for the complicated ones like img
-				# [align]
-				# [body]
-				# [style]
-				# [table]
-				# [row]
-				# [cell]
-				attrs = {}
-				tag_name = inside_tokens[0].casefold()
-				for attr in inside_tokens[1:]:
-					parts = attr.split('=',1)
-					if len(parts[0]) < 1:
-						print('Bad attribute name in tag %s' % token)
-						sys.exit()
-					
-					if len(parts[1]) < 3:
-						print('Bad attribute value in tag %s' % token)
-						sys.exit()
-					
-					if parts[1][0] != '"' or parts[1][-1] != '"':
-						print('Improperly quoted attribute value in tag %s' % token)
-						sys.exit()
-					attrs[ parts[0] ] = parts[1][1:-1]
-
-				if tag_name == 'image':
-
-					out_tag = ['<figure><img']
-					if 'url' in attrs:
-						out_tag.append('%s=%s' % ('src', attr_parts[1]))
-					else:
-						print('Link tag missing required attribute "url": %s' % token)
-						sys.exit()
-					
-					if 'width' in attrs or 'height' in attrs:
-						out_tag.append('style="')
-						if 'width' in attrs:
-							out_tag.append('width: %s;' % attrs['width'])
-						if 'height' in attrs:
-							out_tag.append('height: %s;' % attrs['height'])
-						out_tag.append('"')
-					
-					out_tag.append('>')
-					if 'caption' in attrs:
-						out_tag.append('<figcaption>%s</figcaption>' % attrs['caption'].replace(r'\u0034','"'))
-					sys.stdout.write(' '.join(out_tag))
-				
-				elif tag_name == 'link':
-					out_tag = ['<a']
-					has_url = False
-					for option in inside_tokens[1:]:
-						attr_parts = option.split('=', 1)
-						key = attr_parts[0].casefold()
-						if key != 'name' and key != 'url':
-							print('In tag "%s":\nUnrecognized attribute "%s".' % (token, key))
-							sys.exit()
-						
-						if key == 'url':
-							if len(attr_parts[1]) < 3:
-								print('In tag "%s":\nBad url attribute.' % token)
-								sys.exit()
-							has_url = True
-							out_tag.append('%s=%s' % ('href', attr_parts[1]))
-						else:
-							out_tag.append(option)
-
-					if not has_url:
-						print('Link tag missing required attribute "url": %s' % token)
-						sys.exit()
-					
-					out_tag.append('>')
-					sys.stdout.write(' '.join(out_tag))
-				
-				elif tag_name == 'ulist' or tag_name == 'olist':
-					out_tag = [ '<' + tag_name[0:2]]
-					if len(inside_tokens) > 2:
-						print('Tag "list" only supports 1 optional attribute: style.')
-						sys.exit()
-					if len(inside_tokens) == 2:
-						attr_parts = inside_tokens[1].split('=', 1)
-						key = attr_parts[0].casefold()
-						if key != 'style':
-							print('In tag "%s":\nUnrecognized attribute "%s".' % (token, key))
-							sys.exit()
-						out_tag.append('style="list-style-type: %s"' % attr_parts[1][1:-1])
-					out_tag.append('>')
-					sys.stdout.write(' '.join(out_tag))
-
-				elif tag_name == 'align':
-					out_tag = ['<div']
-					if len(inside_tokens) != 2:
-						print('Tag "align" only supports 1 required attribute: type.')
-						sys.exit()
-					
-					attr_parts = inside_tokens[1].split('=', 1)
-					key = attr_parts[0].casefold()
-					if key != 'type':
-						print('In tag "%s":\nUnrecognized attribute "%s".' % (token, key))
-						sys.exit()
-					out_tag.append('style="text-align: %s">' % attr_parts[1][1:-1])
-					sys.stdout.write(' '.join(out_tag))
-				else:
-					print(inside_tokens)
-				
-				
-		elif token == '\n' or token == '\r\n':
-			sys.stdout.write('<br />\n')
-		else:
-			sys.stdout.write(token)
+		write('<html><body>')
+
+	conversion_map = _conversion_map
+	for kind, inner, start in markupscan.scan(sanitized_text):
+		if kind == markupscan.TEXT:
+			if '\n' in inner:
+				inner = _linebreak_pattern.sub('<br />\n', inner)
+			write(inner)
+			continue
+
+		# We have an AnTM tag, so this will need translated. Simple tags go through the lookup
+		# table. Unrecognized tags are passed through as text.
+		html = conversion_map.get(inner)
+		if html is not None:
+			write(html)
+			continue
 
-						
+		token = '[' + inner + ']'
+		inner = inner.strip()
+		if inner in conversion_map:
+			write(conversion_map[inner])
+			continue
+
+		parts = inner.split(None, 1)
+		tag_name = parts[0].casefold() if parts else ''
+		if tag_name in _complex_tags:
+			try:
+				attrs = _parse_attributes(token, parts[1] if len(parts) > 1 else '')
+				write(_complex_tags[tag_name](tag_name, token, attrs))
+			except AnTMError as e:
+				e.line = sanitized_text.count('\n', 0, start) + 1
+				raise
+		elif tag_name in conversion_map:
+			write(conversion_map[tag_name])
+		else:
+			write(token)
 
 	if fulldocument:
-		tokens.append('</body></html>')
-	
-	return ''.join(tokens)
+		write('</body></html>')
+
+	if sink is None:
+		return out.getvalue()
+	return None
 
 
 test1 = '''
@@ -213,5 +271,346 @@ test1 = '''
 [sup]superscripted text[/sup]
 '''
 
+class AnTMCache:
+	'''A least-recently-used cache of rendered documents which sits in front of AnTM2HTML. Entries
+	are keyed by the BLAKE3 hash of the source text and the fulldocument flag, so a hit skips
+	tokenizing entirely. The in-memory tier is bounded by maxbytes, counting the UTF-8 encoded size
+	of the rendered HTML. If cachedir is given, rendered documents are also saved there and survive
+	between runs. The disk tier is not size-bounded. Hit and miss counts are available from
+	stats().'''
+	def __init__(self, maxbytes=64*1048576, cachedir=''):
+		self.maxbytes = maxbytes
+		self.cachedir = cachedir
+		self.size = 0
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+		if cachedir and not os.path.exists(cachedir):
+			os.makedirs(cachedir, exist_ok=True)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def convert(self, instr: str, fulldocument: bool) -> str:
+		'''Returns the HTML for the AnTM passed to it, rendering it only if it isn't cached'''
+		key = self.key(instr, fulldocument)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry[0]
+
+		html = self._load(key)
+		if html is not None:
+			with self._lock:
+				self.disk_hits += 1
+			self._store(key, html)
+			return html
+
+		html = AnTM2HTML(instr, fulldocument)
+		with self._lock:
+			self.misses += 1
+		self._store(key, html)
+		self._save(key, html)
+		return html
+
+	def clear(self):
+		'''Empties the in-memory tier and resets the statistics'''
+		with self._lock:
+			self._entries.clear()
+			self.size = self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+	def stats(self) -> dict:
+		'''Returns a dictionary of cache statistics'''
+		with self._lock:
+			lookups = self.hits + self.disk_hits + self.misses
+			return {
+				'entries': len(self._entries),
+				'size': self.size,
+				'maxsize': self.maxbytes,
+				'hits': self.hits,
+				'disk_hits': self.disk_hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+			}
+
+	@staticmethod
+	def key(instr: str, fulldocument: bool) -> str:
+		'''Returns the cache key for a document. BLAKE2B is used if the blake3 module isn't
+		installed.'''
+		data = instr.encode()
+		digest = blake3.blake3(data).hexdigest() if blake3 else \
+			hashlib.blake2b(data, digest_size=32).hexdigest()
+		return digest + ('-full' if fulldocument else '')
+
+	def _store(self, key: str, html: str):
+		# Entries hold their encoded size so that it is only measured once
+		size = len(html.encode())
+		if size > self.maxbytes:
+			return
+
+		with self._lock:
+			if key in self._entries:
+				return
+			self._entries[key] = (html, size)
+			self.size += size
+			while self.size > self.maxbytes:
+				_, evicted = self._entries.popitem(last=False)
+				self.size -= evicted[1]
+				self.evictions += 1
+
+	def _diskpath(self, key: str) -> str:
+		return os.path.join(self.cachedir, key[:2], key + '.html')
+
+	def _load(self, key: str) -> str:
+		if not self.cachedir:
+			return None
+		try:
+			with open(self._diskpath(key), 'r', encoding='utf-8') as fhandle:
+				return fhandle.read()
+		except OSError:
+			return None
+
+	def _save(self, key: str, html: str):
+		if not self.cachedir:
+			return
+
+		# Write to a temporary file and rename it so that concurrent readers never see a partial
+		# entry
+		dirpath = os.path.dirname(self._diskpath(key))
+		try:
+			os.makedirs(dirpath, exist_ok=True)
+			fd, temppath = tempfile.mkstemp(dir=dirpath)
+			with os.fdopen(fd, 'w', encoding='utf-8') as fhandle:
+				fhandle.write(html)
+			os.replace(temppath, self._diskpath(key))
+		except OSError:
+			pass
+
+
+# Each batch worker process gets its own cache when caching is enabled
+_worker_cache = None
+
+def _init_worker(maxbytes: int, cachedir: str):
+	'''Process pool initializer which sets up the worker's render cache'''
+	global _worker_cache
+	if maxbytes or cachedir:
+		_worker_cache = AnTMCache(maxbytes, cachedir)
+
+
+def _render(instr: str, fulldocument: bool) -> str:
+	'''Converts a document in a batch worker, going through the cache if there is one'''
+	if _worker_cache is None:
+		return AnTM2HTML(instr, fulldocument)
+	return _worker_cache.convert(instr, fulldocument)
+
+
+def _cache_state() -> tuple:
+	'''Returns the worker's process ID and cache statistics, or None if it has no cache. Every
+	result carries this so that the parent can total the statistics of all workers from the last
+	result it gets from each.'''
+	if _worker_cache is None:
+		return None
+	stats = _worker_cache.stats()
+	return (os.getpid(), stats['hits'], stats['disk_hits'], stats['misses'], stats['evictions'],
+		stats['size'])
+
+
+def _print_cache_stats(states: dict):
+	'''Prints the combined cache statistics of the batch workers'''
+	hits, disk_hits, misses, evictions, size = [ sum(x) for x in zip(*states.values()) ]
+	lookups = hits + disk_hits + misses
+	print(f"Cache: {hits + disk_hits} hits ({disk_hits} from disk), {misses} misses, "
+		f"{(hits + disk_hits) / lookups if lookups else 0.0:.1%} hit ratio, {evictions} evictions, "
+		f"{size / 1048576:.2f} MB held by {len(states)} worker(s)", file=sys.stderr)
+
+
+def _convert_file(job: tuple) -> tuple:
+	'''Batch worker for file mode. Converts one file and saves the result, returning the number of
+	bytes read, an error string, which is empty on success, and the worker's cache state.'''
+	inpath, outpath, fulldocument = job
+	try:
+		with open(inpath, 'r', encoding='utf-8') as fhandle:
+			indata = fhandle.read()
+		html = _render(indata, fulldocument)
+		with open(outpath, 'w', encoding='utf-8') as fhandle:
+			fhandle.write(html)
+	except (AnTMError, OSError, UnicodeError) as e:
+		return (0, f"{inpath}: {e}", _cache_state())
+	return (len(indata.encode()), '', _cache_state())
+
+
+def _convert_record(job: tuple) -> tuple:
+	'''Batch worker for JSON Lines mode. Converts the AnTM in the named field of one record and
+	returns the record's line number, the number of bytes converted, the output line, an error
+	string, and the worker's cache state.'''
+	linenum, line, field, fulldocument = job
+	try:
+		record = json.loads(line)
+		indata = record[field]
+		if not isinstance(indata, str):
+			raise TypeError(f"field '{field}' is not a string")
+		record['html'] = _render(indata, fulldocument)
+	except (AnTMError, KeyError, TypeError, ValueError) as e:
+		return (linenum, 0, '', str(e), _cache_state())
+	return (linenum, len(indata.encode()), json.dumps(record, ensure_ascii=False) + '\n', '',
+		_cache_state())
+
+
+def _ordered_map(executor, func, jobs, chunksize: int, window: int):
+	'''Like executor.map(), but only submits a window of jobs at a time so that huge inputs aren't
+	read entirely into memory before the first result comes back'''
+	jobs = iter(jobs)
+	while True:
+		block = list(islice(jobs, window))
+		if not block:
+			return
+		yield from executor.map(func, block, chunksize=chunksize)
+
+
+def _find_files(paths: list) -> list:
+	'''Expands a list of files and directories into a sorted list of files. Each is paired with
+	its path relative to the directory it was found in or, for files given directly, its name.'''
+	out = list()
+	for item in paths:
+		if os.path.isdir(item):
+			for root, _, files in os.walk(item):
+				for name in sorted(files):
+					if not name.casefold().endswith('.html'):
+						path = os.path.join(root, name)
+						out.append((path, os.path.relpath(path, item)))
+		else:
+			out.append((item, os.path.basename(item)))
+	return out
+
+
+def run_batch(options: argparse.Namespace) -> int:
+	'''Converts many documents in a process pool. Output order matches input order. Returns the
+	number of documents which could not be converted.'''
+
+	failures = 0
+	doccount = 0
+	bytecount = 0
+	
+	# The latest cache statistics from each worker, by process ID
+	cachestates = dict()
+	window = options.chunksize * options.jobs * 4
+	start = time.perf_counter()
+
+	with ProcessPoolExecutor(max_workers=options.jobs, initializer=_init_worker,
+							initargs=(options.cache_size * 1048576, options.cache_dir)) as executor:
+		if options.jsonl:
+			outfile = sys.stdout
+			if options.out:
+				outfile = open(options.out, 'w', encoding='utf-8')
+			for inpath in options.inputs:
+				with open(inpath, 'r', encoding='utf-8') as infile:
+					jobs = ((linenum, line, options.field, options.full)
+							for linenum, line in enumerate(infile, 1) if line.strip())
+					for linenum, size, outline, error, state in _ordered_map(executor,
+										_convert_record, jobs, options.chunksize, window):
+						if state:
+							cachestates[state[0]] = state[1:]
+						doccount += 1
+						bytecount += size
+						if error:
+							failures += 1
+							print(f"{inpath} line {linenum}: {error}", file=sys.stderr)
+						else:
+							outfile.write(outline)
+			if options.out:
+				outfile.close()
+		else:
+			if options.out and not os.path.exists(options.out):
+				os.makedirs(options.out)
+			# Files under --out keep their place relative to the directory they were found in.
+			# Documents which would be saved over one another, such as a.antm and a.txt, are
+			# refused rather than having one silently replace the other.
+			jobs = list()
+			outpaths = dict()
+			for inpath, relpath in _find_files(options.inputs):
+				if options.out:
+					outpath = os.path.join(options.out, os.path.splitext(relpath)[0] + '.html')
+				else:
+					outpath = os.path.splitext(inpath)[0] + '.html'
+				
+				key = os.path.normcase(os.path.abspath(outpath))
+				if key in outpaths:
+					doccount += 1
+					failures += 1
+					print(f"{inpath}: not converted because {outpaths[key]} is also saved as "
+						f"{outpath}", file=sys.stderr)
+					continue
+				outpaths[key] = inpath
+				
+				os.makedirs(os.path.dirname(outpath) or '.', exist_ok=True)
+				jobs.append((inpath, outpath, options.full))
+
+			for size, error, state in _ordered_map(executor, _convert_file, jobs,
+													options.chunksize, window):
+				if state:
+					cachestates[state[0]] = state[1:]
+				doccount += 1
+				bytecount += size
+				if error:
+					failures += 1
+					print(error, file=sys.stderr)
+
+	elapsed = max(time.perf_counter() - start, 1e-9)
+	print(f"Converted {doccount - failures} of {doccount} documents in {elapsed:.2f}s: "
+		f"{doccount / elapsed:.1f} documents/s, {bytecount / elapsed / 1048576:.2f} MB/s",
+		file=sys.stderr)
+	if cachestates:
+		_print_cache_stats(cachestates)
+	return failures
+
+
+def handle_arguments() -> argparse.Namespace:
+	'''Parses the command-line arguments'''
+	parser = argparse.ArgumentParser(description='Converts AnTM documents to HTML. Without '
+		'arguments, the built-in test document is converted.')
+	parser.add_argument('inputs', nargs='*',
+		help='files or directories of AnTM documents or, with --jsonl, JSON Lines files')
+	parser.add_argument('--full', action='store_true',
+		help='wrap output in html and body tags')
+	parser.add_argument('--jsonl', action='store_true',
+		help='inputs are JSON Lines files with one document per record')
+	parser.add_argument('--field', default='body',
+		help='record field containing the AnTM in JSON Lines mode. Default: body')
+	parser.add_argument('--out', default='',
+		help='output directory in file mode. Output file in JSON Lines mode.')
+	parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+		help='number of worker processes')
+	parser.add_argument('--cache-size', type=int, default=0,
+		help='size in MB of the in-memory render cache in each worker. Default: disabled')
+	parser.add_argument('--cache-dir', default='',
+		help='directory for a persistent render cache shared between workers and runs')
+	parser.add_argument('--chunksize', type=int, default=64,
+		help='number of documents sent to a worker at a time')
+	args = parser.parse_args()
+	if args.jobs < 1 or args.chunksize < 1 or args.cache_size < 0:
+		parser.error('--jobs, --chunksize and --cache-size must be positive')
+	return args
+
+
 if __name__ == '__main__':
-	AnTM2HTML(test1, False)
+	options = handle_arguments()
+	if not options.inputs:
+		try:
+			AnTM2HTML(test1, options.full, sys.stdout)
+		except AnTMError as e:
+			print(e, file=sys.stderr)
+			sys.exit(-1)
+		sys.exit(0)
+
+	try:
+		sys.exit(1 if run_batch(options) else 0)
+	except OSError as e:
+		print(f"Batch conversion failed: {e}", file=sys.stderr)
+		sys.exit(-1)
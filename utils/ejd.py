@@ -17,6 +17,8 @@ import nacl.secret
 import nacl.utils
 from pymensago.keycard import CryptoString, Base85Encoder
 
+from keystore import KeyStore, is_keystore
+
 debug_mode = False
 
 global_options = {
@@ -26,6 +28,7 @@ global_options = {
 	'mode' : '',
 	'pubkey' : CryptoString(),
 	'privkey' : CryptoString(),
+	'keystore' : '',
 	'ejdfile' : '',
 	'outpath' : ''
 }
@@ -34,7 +37,7 @@ def print_usage():
 	'''Prints the usage for the script'''
 	print("Usage: %s encrypt <keyfile> <output_file> <input_file> [<input_file2> ...] " % \
 			os.path.basename(sys.argv[0]))
-	print("Usage: %s decrypt <keyfile> <ejd_file> <output_dir> " % \
+	print("Usage: %s decrypt <keyfile|keystore> <ejd_file> <output_dir> " % \
 			os.path.basename(sys.argv[0]))
 	sys.exit(0)
 
@@ -131,6 +134,18 @@ def ejd_decrypt(indata : dict, outpath : str):
 		
 	secretkeystr = CryptoString(indata['Item']['Key'])
 
+	# When given a keystore, look up the keypair by the hash recorded in the file instead of
+	# requiring the caller to know which key was used
+	if global_options['keystore']:
+		with KeyStore(global_options['keystore']) as keystore:
+			keys = keystore.find(indata['Item']['KeyHash'])
+		if keys is None or 'PrivateKey' not in keys:
+			print(f"No private key for {indata['Item']['KeyHash']} in {global_options['keystore']}."
+				" Unable to decrypt.")
+			return
+		global_options['pubkey'] = CryptoString(keys['PublicKey'])
+		global_options['privkey'] = CryptoString(keys['PrivateKey'])
+
 	# Hash supplied pubkey and compare to KeyHash
 	hasher = hashlib.blake2b(digest_size=32)
 	hasher.update(global_options['pubkey'].as_string().encode())
@@ -279,6 +294,10 @@ def handle_arguments():
 		print_usage()
 	global_options['mode'] = command
 	
+	if command == 'decrypt' and is_keystore(sys.argv[2]):
+		global_options['keystore'] = sys.argv[2]
+		return
+
 	keys = load_keyfile(sys.argv[2])
 	global_options['pubkey'] = CryptoString(keys['PublicKey'])
 	if command == 'decrypt':
@@ -6,39 +6,67 @@
 # Released under the terms of the MIT license
 # ©2019-2020 Jon Yoder <jon@yoder.cloud>
 
+import argparse
 import base64
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
 import json
+import os
 from os import path
 import sys
+import time
 
 import nacl.signing
 import nacl.public
 import nacl.secret
 import nacl.utils
 
-def generate_encpair(filename):
-	'''Creates a asymmetric keypair and saves it to a file in Base85 encoding'''
+def make_encpair() -> dict:
+	'''Creates an asymmetric encryption keypair and returns it as a dictionary of Base85-encoded
+	strings'''
 	keypair = nacl.public.PrivateKey.generate()
-	
+
 	hasher=hashlib.blake2b(digest_size=32)
 	hasher.update(keypair.public_key.encode())
-	publicHash = "BLAKE2B-256:" + base64.b85encode(hasher.digest()).decode()
+	return {
+		'PublicKey' : 'CURVE25519:' + base64.b85encode(keypair.public_key.encode()).decode(),
+		'PublicHash' : 'BLAKE2B-256:' + base64.b85encode(hasher.digest()).decode(),
+		'PrivateKey' : 'CURVE25519:' + base64.b85encode(keypair.encode()).decode()
+	}
+
+
+def make_signpair() -> dict:
+	'''Creates an asymmetric signing keypair and returns it as a dictionary of Base85-encoded
+	strings'''
+	keypair = nacl.signing.SigningKey.generate()
+
+	hasher=hashlib.blake2b(digest_size=32)
+	hasher.update(keypair.verify_key.encode())
+	return {
+		'VerificationKey' : 'ED25519:' + base64.b85encode(keypair.verify_key.encode()).decode(),
+		'VerificationHash' : 'BLAKE2B-256:' + base64.b85encode(hasher.digest()).decode(),
+		'SigningKey' : 'ED25519:' + base64.b85encode(keypair.encode()).decode()
+	}
+
+
+def generate_encpair(filename):
+	'''Creates a asymmetric keypair and saves it to a file in Base85 encoding'''
+	keys = make_encpair()
 	if not filename:
 		print('Keypair type: encryption\r\n')
-		print('public: CURVE25519:%s' % base64.b85encode(keypair.public_key.encode()).decode())
-		print('public hash: %s' % publicHash)
-		print('private: CURVE25519:%s' % base64.b85encode(keypair.encode()).decode())
+		print('public: %s' % keys['PublicKey'])
+		print('public hash: %s' % keys['PublicHash'])
+		print('private: %s' % keys['PrivateKey'])
 		return
 
 	if path.exists(filename):
 		response = input("%s exists. Overwrite? [y/N]: " % filename)
 		if not response or response.casefold()[0] != 'y':
 			return
-	
+
 	out = {
-		'PublicKey' : 'CURVE25519:' + base64.b85encode(keypair.public_key.encode()).decode(),
-		'PrivateKey' : 'CURVE25519:' + base64.b85encode(keypair.encode()).decode()
+		'PublicKey' : keys['PublicKey'],
+		'PrivateKey' : keys['PrivateKey']
 	}
 	try:
 		fhandle = open(filename, 'w')
@@ -50,26 +78,22 @@ def generate_encpair(filename):
 
 def generate_signpair(filename):
 	'''Creates a asymmetric signing keypair and saves it to a file in Base85 encoding'''
-	keypair = nacl.signing.SigningKey.generate()
-	
-	hasher=hashlib.blake2b(digest_size=32)
-	hasher.update(keypair.verify_key.encode())
-	verifyHash = "BLAKE2B-256:" + base64.b85encode(hasher.digest()).decode()
+	keys = make_signpair()
 	if not filename:
 		print('Keypair type: signing\r\n')
-		print('verify: ED25519:%s' % base64.b85encode(keypair.verify_key.encode()).decode())
-		print('verify hash: %s' % verifyHash)
-		print('signing: ED25519:%s' % base64.b85encode(keypair.encode()).decode())
+		print('verify: %s' % keys['VerificationKey'])
+		print('verify hash: %s' % keys['VerificationHash'])
+		print('signing: %s' % keys['SigningKey'])
 		return
-	
+
 	if path.exists(filename):
 		response = input("%s exists. Overwrite? [y/N]: " % filename)
 		if not response or response.casefold()[0] != 'y':
 			return
 
 	out = {
-		'VerificationKey' : 'ED25519:' + base64.b85encode(keypair.verify_key.encode()).decode(),
-		'SigningKey' : 'ED25519:' + base64.b85encode(keypair.encode()).decode()
+		'VerificationKey' : keys['VerificationKey'],
+		'SigningKey' : keys['SigningKey']
 	}
 	try:
 		fhandle = open(filename, 'w')
@@ -79,16 +103,73 @@ def generate_signpair(filename):
 		print('Unable to save %s: %s' % (filename, e))
 
 
+def _make_batch(args) -> str:
+	'''Worker function for bulk generation. Creates a batch of keypairs and returns them as a
+	block of JSON Lines so that only one string crosses the process boundary per batch.'''
+	keytype, count = args
+	maker = make_encpair if keytype == 'encrypt' else make_signpair
+	return ''.join([json.dumps(maker(), ensure_ascii=False) + '\n' for _ in range(count)])
+
+
+def generate_bulk(keytype: str, count: int, outfile, jobs=None, batchsize=1000) -> int:
+	'''Generates count keypairs of the requested type across a pool of worker processes and
+	streams them to the file-like object outfile as JSON Lines. Returns the number of keypairs
+	written.'''
+
+	batches = [ (keytype, batchsize) ] * (count // batchsize)
+	if count % batchsize:
+		batches.append((keytype, count % batchsize))
+
+	with ProcessPoolExecutor(max_workers=jobs) as executor:
+		for block in executor.map(_make_batch, batches):
+			outfile.write(block)
+
+	return count
+
+
+def handle_arguments() -> argparse.Namespace:
+	'''Parses the command-line arguments'''
+	parser = argparse.ArgumentParser(description='Generates encryption and signing key pairs')
+	parser.add_argument('keytype', type=str.casefold, choices=['sign', 'encrypt'],
+		help='type of keypair to generate')
+	parser.add_argument('filename', nargs='?', default='',
+		help='file to save a single keypair to. Printed to stdout if omitted.')
+	parser.add_argument('--count', type=int, default=0,
+		help='number of keypairs to generate in bulk mode')
+	parser.add_argument('--out', default='-',
+		help='JSON Lines file for bulk mode output. Defaults to stdout.')
+	parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+		help='number of worker processes to use in bulk mode')
+
+	args = parser.parse_args()
+	if args.count < 0 or args.jobs < 1:
+		parser.error('--count and --jobs must be positive')
+	if args.count and args.filename:
+		parser.error('use --out instead of a filename in bulk mode')
+	return args
+
+
 if __name__ == '__main__':
-	if len(sys.argv) not in [2,3] or sys.argv[1].casefold() not in ['sign', 'encrypt']:
-		print("Usage: %s <sign|encrypt> <filename>" % path.basename(sys.argv[0]))
+	options = handle_arguments()
+
+	if options.count:
+		start = time.perf_counter()
+		try:
+			if options.out == '-':
+				generate_bulk(options.keytype, options.count, sys.stdout, options.jobs)
+			else:
+				with open(options.out, 'w') as fhandle:
+					generate_bulk(options.keytype, options.count, fhandle, options.jobs)
+		except Exception as e:
+			print('Unable to save %s: %s' % (options.out, e), file=sys.stderr)
+			sys.exit(-1)
+
+		elapsed = time.perf_counter() - start
+		print('Generated %d keypairs in %.2fs (%.0f/s)' % (options.count, elapsed,
+			options.count / elapsed), file=sys.stderr)
 		sys.exit(0)
-	
-	keyfile = ''
-	if len(sys.argv) == 3:
-		keyfile = sys.argv[2]
 
-	if sys.argv[1].casefold() == 'encrypt':
-		generate_encpair(keyfile)
+	if options.keytype == 'encrypt':
+		generate_encpair(options.filename)
 	else:
-		generate_signpair(keyfile)
+		generate_signpair(options.filename)
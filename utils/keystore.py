@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# keystore - a single-file store for many encryption keypairs, indexed by key hash
+
+# Released under the terms of the MIT license
+# ©2020 Jon Yoder <jon@yoder.cloud>
+
+from base64 import b85encode
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+# The first 16 bytes of every SQLite database file
+_sqlite_magic = b'SQLite format 3\x00'
+
+def keyhash(pubkey: str) -> str:
+	'''Returns the hash used to identify a public key. Like ejd.py, this is a hash of the encoded
+	string -- the prefix, separator, and Base85-encoded key -- not of the raw key bytes.'''
+	hasher = hashlib.blake2b(digest_size=32)
+	hasher.update(pubkey.encode())
+	return "BLAKE2B-256:" + b85encode(hasher.digest()).decode()
+
+
+def is_keystore(path: str) -> bool:
+	'''Returns true if the file at the path is a keystore rather than a JSON keyfile'''
+	try:
+		with open(path, 'rb') as fhandle:
+			return fhandle.read(len(_sqlite_magic)) == _sqlite_magic
+	except OSError:
+		return False
+
+
+class KeyStore:
+	'''Stores keypairs in a single SQLite file. The hash of each public key is the table's primary
+	key, so lookups are a B-tree search instead of a scan over keyfiles.'''
+	def __init__(self, path: str):
+		self.path = path
+		self.db = sqlite3.connect(path)
+		self.db.execute('''CREATE TABLE IF NOT EXISTS keys (
+			keyhash TEXT PRIMARY KEY NOT NULL,
+			pubkey TEXT NOT NULL,
+			privkey TEXT
+		) WITHOUT ROWID''')
+		self.db.commit()
+
+	def __len__(self):
+		return self.db.execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		'''Closes the underlying database'''
+		self.db.close()
+
+	def add(self, pubkey: str, privkey: str = '') -> str:
+		'''Adds a keypair to the store, replacing any existing entry for the same public key.
+		Returns the key's hash.'''
+		return self.add_many([ { 'PublicKey':pubkey, 'PrivateKey':privkey } ])[0]
+
+	def add_many(self, keypairs) -> list:
+		'''Adds an iterable of encryption keypair dictionaries, such as those in a keyfile or output
+		from genkeypair's bulk mode, in a single transaction. Returns the list of key hashes.
+		Signing keypairs aren't supported, and ValueError is raised if any record lacks a
+		PublicKey, in which case nothing is added.'''
+		rows = list()
+		for i, item in enumerate(keypairs, 1):
+			pubkey = item.get('PublicKey') if isinstance(item, dict) else None
+			if not pubkey:
+				if isinstance(item, dict) and 'VerificationKey' in item:
+					raise ValueError(f"keypair {i} is a signing keypair, which is not supported")
+				raise ValueError(f"keypair {i} has no PublicKey")
+			rows.append((keyhash(pubkey), pubkey, item.get('PrivateKey') or None))
+
+		with self.db:
+			self.db.executemany('INSERT OR REPLACE INTO keys(keyhash, pubkey, privkey) '
+				'VALUES(?,?,?)', rows)
+		return [ row[0] for row in rows ]
+
+	def find(self, hashstr: str) -> dict:
+		'''Returns the keypair matching the given hash in the same format as a keyfile or None if
+		the store does not contain it.'''
+		row = self.db.execute('SELECT pubkey, privkey FROM keys WHERE keyhash=?',
+			(hashstr,)).fetchone()
+		if row is None:
+			return None
+
+		out = { 'PublicKey' : row[0] }
+		if row[1]:
+			out['PrivateKey'] = row[1]
+		return out
+
+
+def import_keys(store: KeyStore, inpath: str) -> int:
+	'''Imports either a single JSON keyfile or a JSON Lines file of keypairs into the store and
+	returns the number of keys imported'''
+	with open(inpath, 'r') as fhandle:
+		if inpath.casefold().endswith('.jsonl'):
+			keypairs = (json.loads(line) for line in fhandle if line.strip())
+		else:
+			keypairs = [ json.load(fhandle) ]
+		return len(store.add_many(keypairs))
+
+
+def print_usage():
+	'''Prints the usage for the script'''
+	print("Usage: %s import <keystore> <keyfile|keys.jsonl> [...]" % os.path.basename(sys.argv[0]))
+	print("Usage: %s find <keystore> <keyhash>" % os.path.basename(sys.argv[0]))
+	sys.exit(0)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 4 or sys.argv[1].casefold() not in ['import', 'find']:
+		print_usage()
+
+	with KeyStore(sys.argv[2]) as keystore:
+		if sys.argv[1].casefold() == 'import':
+			for item in sys.argv[3:]:
+				try:
+					print('Imported %d keys from %s' % (import_keys(keystore, item), item))
+				except Exception as e:
+					print('Unable to import %s: %s' % (item, e))
+		else:
+			keys = keystore.find(sys.argv[3])
+			if keys is None:
+				print(f"{sys.argv[3]} not found")
+				sys.exit(-1)
+			print(json.dumps(keys, ensure_ascii=False, indent='\t'))
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+# markupbench - benchmarks for the SDF and AnTM markup parsers
+
+# Released under the terms of the MIT license
+# ©2020 Jon Yoder <jon@yoder.cloud>
+
+import argparse
+import math
+import re
+import sys
+import time
+import tracemalloc
+
+import antm2html
+import markupgen
+import markupscan
+import sdfparse
+
+class _LegacyTag:
+	'''The Tag class as it was before it used __slots__, for comparison'''
+	def __init__(self):
+		self.name = ''
+		self.attributes = dict()
+		self.is_closing = False
+
+
+def _legacy_token(token):
+	'''Converts a token into the form the tokenizer used to produce: a Tag with its own __dict__,
+	its own attribute dictionary, and its own copy of the tag name.'''
+	if isinstance(token, str):
+		return token
+
+	out = _LegacyTag()
+	out.name = token.name.casefold()
+	out.attributes.update(token.attributes)
+	out.is_closing = token.is_closing
+	return out
+
+
+def _legacy_parse_tag(tagstr: str) -> _LegacyTag:
+	'''parse_tag() as it was before it used precompiled patterns and the tag table, for
+	comparison'''
+	out = _LegacyTag()
+	
+	m = re.search(r'^(\/?)([a-zA-z0-9]+)', tagstr)
+	if m is None:
+		return None
+	
+	if m[0][0] == '/':
+		out.is_closing = True
+		out.name = m[0][1:].casefold()
+		return out
+
+	out.name = m[0].casefold()
+
+	matches = re.findall(r'[a-zA-Z0-9]+=\"[^\"]*\"', tagstr)
+	for match in matches:
+		parts = match.split('=')
+		if len(parts) != 2:
+			continue
+		
+		try:
+			out.attributes[parts[0].strip().casefold()] = parts[1][1:-1]
+		except:
+			continue
+
+	return out
+
+
+def make_document(size: int) -> str:
+	'''Returns an SDF document of at least size bytes made of copies of sdfparse.test1'''
+	return sdfparse.test1 * (size // len(sdfparse.test1.encode()) + 1)
+
+
+def measure_retained(func) -> tuple:
+	'''Calls func and returns its result along with the number of bytes still allocated by it when
+	it returns'''
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	result = func()
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return (result, after - before)
+
+
+def bench_memory(options: argparse.Namespace):
+	'''Compares the memory used by tokenizing a document with the current and legacy token
+	classes'''
+	document = make_document(options.size * 1048576)
+
+	tokens, current = measure_retained(lambda: sdfparse.tokenize(document))
+	count = len(tokens)
+	del tokens
+
+	tokens, legacy = measure_retained(lambda: [ _legacy_token(t) for t in
+												sdfparse.iter_tokens(document) ])
+	del tokens
+
+	print(f"Document size: {len(document.encode())} bytes, {count} tokens")
+	print(f"Before: {legacy} bytes, {legacy / count:.1f} bytes/token")
+	print(f"After:  {current} bytes, {current / count:.1f} bytes/token")
+	print(f"Saved:  {100 * (legacy - current) / legacy:.1f}%")
+
+
+def bench_tags(options: argparse.Namespace):
+	'''Measures how many tags per second parse_tag() can handle using the tags found in
+	sdfparse.test1'''
+	tagstrs = [ m.strip() for m in re.findall(r'\[([^\]]+)\]', sdfparse.test1) ]
+	tagstrs = tagstrs * (options.count // len(tagstrs) + 1)
+	tagstrs = tagstrs[:options.count]
+
+	for label, func in [ ('Legacy', _legacy_parse_tag), ('Current', sdfparse.parse_tag) ]:
+		best = None
+		for _ in range(options.rounds):
+			start = time.perf_counter()
+			for tagstr in tagstrs:
+				func(tagstr)
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+		print(f"{label}: {len(tagstrs) / best:,.0f} tags/s")
+
+
+def make_corpora(size: int) -> list:
+	'''Returns a list of name, text pairs to benchmark with: each front end's test document and a
+	large synthetic document of at least size bytes with both of them mixed together'''
+	mixed = sdfparse.test1 + antm2html.test1
+	return [
+		('antm-test1', antm2html.test1),
+		('sdf-test1', sdfparse.test1),
+		('synthetic', mixed * (size // len(mixed.encode()) + 1)),
+	]
+
+
+def time_best(func, rounds: int) -> float:
+	'''Returns the shortest of several timings of a function call'''
+	best = None
+	for _ in range(rounds):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return max(best, 1e-9)
+
+
+def _report(label: str, text: str, elapsed: float, repeat: int):
+	megabytes = len(text.encode()) * repeat / 1048576
+	print(f"{label:<36} {megabytes / elapsed:8.2f} MB/s")
+
+
+def bench_scanners(options: argparse.Namespace):
+	'''Compares the regular expression and state machine implementations of the shared scanner'''
+	for name, text in make_corpora(options.size * 1048576):
+		# Small documents are scanned repeatedly so that they can be timed meaningfully
+		repeat = max(1, options.size * 1048576 // len(text.encode()))
+		for label, func in [ ('regex', markupscan.scan_regex),
+							('statemachine', markupscan.scan_statemachine) ]:
+			def run():
+				for _ in range(repeat):
+					for _ in func(text):
+						pass
+			_report(f"{name} {label}", text, time_best(run, options.rounds), repeat)
+
+
+def bench_frontends(options: argparse.Namespace):
+	'''Runs AnTM2HTML and sdfparse.tokenize over each of the corpora'''
+	for name, text in make_corpora(options.size * 1048576):
+		repeat = max(1, options.size * 1048576 // len(text.encode()))
+		def run_antm():
+			for _ in range(repeat):
+				antm2html.AnTM2HTML(text, True)
+		def run_sdf():
+			for _ in range(repeat):
+				sdfparse.tokenize(text)
+		_report(f"{name} AnTM2HTML", text, time_best(run_antm, options.rounds), repeat)
+		_report(f"{name} sdfparse.tokenize", text, time_best(run_sdf, options.rounds), repeat)
+
+
+# Each stress case is a name and a function which returns a document of about the requested size.
+# The generated cases are valid documents with particular shapes. The adversarial cases are the
+# kind of input which sends a backtracking regular expression into quadratic or exponential time.
+_stress_cases = [
+	('generated', lambda kind, n: markupgen.generate(kind, n, seed=1)),
+	('deep-nesting', lambda kind, n: markupgen.generate(kind, n, seed=2, maxdepth=500,
+		textlen=2)),
+	('large-tables', lambda kind, n: markupgen.generate(kind, n, seed=3, maxdepth=3,
+		tablesize=300)),
+	('long-text', lambda kind, n: markupgen.generate(kind, n, seed=4, maxdepth=2,
+		textlen=20000)),
+	('many-attributes', lambda kind, n: ('[link ' + ' '.join(f'url{i}="v{i}"'
+		for i in range(n // 12)) + ']')),
+	('open-brackets', lambda kind, n: '[' * n),
+	('unclosed-tags', lambda kind, n: '[b' * (n // 2)),
+	('padded-tag', lambda kind, n: '[b' + ' ' * n + ']'),
+	('whitespace', lambda kind, n: ' \n\t' * (n // 3)),
+	('close-brackets', lambda kind, n: ']' * n),
+]
+
+def _antm_frontend(text: str):
+	try:
+		antm2html.AnTM2HTML(text, True)
+	except antm2html.AnTMError:
+		# Some adversarial cases are invalid. Reaching the error is all that matters here.
+		pass
+
+
+def bench_stress(options: argparse.Namespace):
+	'''Runs the front ends over generated and adversarial documents at increasing sizes and
+	reports throughput, peak memory, and how running time scales with input size'''
+	frontends = [ ('AnTM2HTML', 'antm', _antm_frontend), ('sdfparse', 'sdf', sdfparse.tokenize) ]
+	sizes = [ options.size * 1024 * (2 ** i) for i in range(options.steps) ]
+	failures = list()
+
+	print(f"{'case':<34}{'tokens/s':>14}{'peak MB':>10}{'scaling':>9}")
+	for casename, make in _stress_cases:
+		for label, kind, func in frontends:
+			timings = list()
+			lengths = list()
+			for size in sizes:
+				text = make(kind, size)
+				lengths.append(len(text))
+				timings.append(time_best(lambda: func(text), options.rounds))
+
+			# Tokens per second and peak memory come from the largest document
+			tokens = sum(1 for _ in markupscan.scan(text))
+			tracemalloc.start()
+			func(text)
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+			# The scaling exponent is the slope of time against size on a log-log scale between
+			# the two largest documents: 1.0 is linear, 2.0 is quadratic. Actual lengths are used
+			# because generated documents overshoot the requested size by varying amounts.
+			# If the documents didn't grow enough to tell, no exponent is given rather than one
+			# which can never flag anything.
+			exponent = None
+			if len(timings) > 1 and lengths[-1] > lengths[-2] * 1.2:
+				exponent = math.log(timings[-1] / timings[-2]) / math.log(lengths[-1] / lengths[-2])
+			flag = ''
+			# Runs of a few milliseconds are too noisy to say anything about scaling
+			if exponent is not None and exponent > options.threshold and timings[-1] > 0.01:
+				flag = '  <-- superlinear'
+				failures.append(f"{casename} {label}")
+			scaling = 'n/a' if exponent is None else f"{exponent:.2f}"
+			print(f"{casename + ' ' + label:<34}{tokens / timings[-1]:>14,.0f}"
+				f"{peak / 1048576:>10.1f}{scaling:>9}{flag}")
+
+	if failures:
+		print(f"\nSuperlinear scaling: {', '.join(failures)}")
+		sys.exit(1)
+
+
+def handle_arguments() -> argparse.Namespace:
+	'''Parses the command-line arguments'''
+	parser = argparse.ArgumentParser(description='Benchmarks for the SDF and AnTM parsers')
+	subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+	memparser = subparsers.add_parser('memory', help='bytes per token of tokenized SDF')
+	memparser.add_argument('--size', type=int, default=1, help='document size in MB')
+	memparser.set_defaults(func=bench_memory)
+
+	tagparser = subparsers.add_parser('tags', help='tags per second parsed by parse_tag()')
+	tagparser.add_argument('--count', type=int, default=200000, help='number of tags to parse')
+	tagparser.add_argument('--rounds', type=int, default=3, help='best of this many rounds')
+	tagparser.set_defaults(func=bench_tags)
+
+	for name, func, helptext in [
+			('scanners', bench_scanners, 'MB/s of each markupscan implementation'),
+			('frontends', bench_frontends, 'MB/s of AnTM2HTML and sdfparse.tokenize')]:
+		subparser = subparsers.add_parser(name, help=helptext)
+		subparser.add_argument('--size', type=int, default=4, help='corpus size in MB')
+		subparser.add_argument('--rounds', type=int, default=3, help='best of this many rounds')
+		subparser.set_defaults(func=func)
+
+	stressparser = subparsers.add_parser('stress',
+		help='throughput, peak memory, and scaling on generated and adversarial input')
+	stressparser.add_argument('--size', type=int, default=128,
+		help='smallest document size in KB')
+	stressparser.add_argument('--steps', type=int, default=3,
+		help='number of sizes to test. Each is double the previous one.')
+	stressparser.add_argument('--rounds', type=int, default=3, help='best of this many rounds')
+	stressparser.add_argument('--threshold', type=float, default=1.5,
+		help='scaling exponent above which a case is reported as a failure')
+	stressparser.set_defaults(func=bench_stress)
+
+	return parser.parse_args()
+
+
+if __name__ == '__main__':
+	options = handle_arguments()
+	options.func(options)
+	sys.exit(0)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# markupgen - generates large, randomized, but valid AnTM and SDF documents for testing
+
+# Released under the terms of the MIT license
+# ©2020 Jon Yoder <jon@yoder.cloud>
+
+import argparse
+import json
+import random
+import sys
+
+_words = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+	'incididunt ut labore et dolore magna aliqua mensago message contact keycard workspace '
+	'profile domain signature encryption').split()
+
+_antm_inline = ('b', 'i', 'u', 's', 'sub', 'sup')
+_sdf_inline = ('b', 'i', 'u', 's', 'sub', 'sup')
+_sdf_blocks = ('p', 'quote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+
+class _Generator:
+	'''Common code for the document generators. Output is built in a list of strings until the
+	requested size is reached.'''
+	def __init__(self, size: int, seed: int, maxdepth: int, textlen: int, tablesize: int):
+		self.rng = random.Random(seed)
+		self.size = size
+		self.maxdepth = maxdepth
+		self.textlen = textlen
+		self.tablesize = tablesize
+		self.out = list()
+		self.length = 0
+
+	def emit(self, text: str):
+		'''Adds text to the document'''
+		self.out.append(text)
+		self.length += len(text)
+
+	def full(self) -> bool:
+		'''Returns true once the document has reached its requested size. Nested constructs stop
+		branching once this is true so that deeply-nested documents do not grow exponentially.'''
+		return self.length >= self.size
+
+	def text(self):
+		'''Emits a run of random words of up to textlen words. The run stops early once the
+		document reaches its requested size so that long runs don't overshoot it by much.'''
+		count = self.rng.randint(1, self.textlen)
+		remaining = self.size - self.length
+		words = list()
+		length = 0
+		for _ in range(count):
+			word = self.rng.choice(_words)
+			words.append(word)
+			length += len(word) + 1
+			if length >= remaining:
+				break
+		self.emit(' '.join(words))
+
+	def attrs(self, names: tuple) -> str:
+		'''Returns a string of random attribute values for the attribute names given'''
+		return ''.join(f' {name}="{self.rng.choice(_words)}"' for name in names)
+
+
+class AnTMGenerator(_Generator):
+	'''Generates AnTM documents which AnTM2HTML accepts without error'''
+	def generate(self) -> str:
+		'''Returns a generated document'''
+		while not self.full():
+			self.block(0)
+			self.emit('\n')
+		return ''.join(self.out)
+
+	def block(self, depth: int):
+		'''Emits a random block-level construct'''
+		choice = self.rng.random()
+		if depth >= self.maxdepth or choice < 0.4 or self.full():
+			self.inline(depth)
+		elif choice < 0.55:
+			self.emit('[quote]')
+			self.block(depth + 1)
+			self.emit('[/quote]')
+		elif choice < 0.7:
+			kind = self.rng.choice(('ulist', 'olist'))
+			self.emit(f'[{kind} style="{self.rng.choice(("disc", "circle", "upper-roman"))}"]\n')
+			for _ in range(self.rng.randint(1, self.tablesize)):
+				self.emit('    [li]')
+				self.inline(depth + 1)
+				self.emit('[/li]\n')
+				if self.full():
+					break
+			self.emit(f'[/{kind}]')
+		elif choice < 0.8:
+			self.emit('[table]\n')
+			columns = self.rng.randint(1, self.tablesize)
+			for _ in range(self.rng.randint(1, self.tablesize)):
+				self.emit('[row]')
+				for _ in range(columns):
+					self.emit('[cell]')
+					self.text()
+					self.emit('[/cell]')
+				self.emit('[/row]\n')
+				if self.full():
+					break
+			self.emit('[/table]')
+		elif choice < 0.9:
+			self.emit(f'[align type="{self.rng.choice(("left", "center", "right"))}"]')
+			self.block(depth + 1)
+			self.emit('[/align]')
+		else:
+			self.emit('[code]')
+			self.text()
+			self.emit('[/code]')
+
+	def inline(self, depth: int):
+		'''Emits text with random nested inline formatting'''
+		for _ in range(self.rng.randint(1, 4)):
+			choice = self.rng.random()
+			if depth >= self.maxdepth or choice < 0.4 or self.full():
+				self.text()
+			elif choice < 0.8:
+				tag = self.rng.choice(_antm_inline)
+				self.emit(f'[{tag}]')
+				self.inline(depth + 1)
+				self.emit(f'[/{tag}]')
+			elif choice < 0.9:
+				self.emit('[style' + self.attrs(('family', 'size', 'color')) + ']')
+				self.inline(depth + 1)
+				self.emit('[/style]')
+			else:
+				self.emit(f'[link name="{self.rng.choice(_words)}" '
+					f'url="https://example.com/{self.rng.choice(_words)}?a=1&b=2"]')
+				self.text()
+				self.emit('[/link]')
+			self.emit(' ')
+
+
+class SDFGenerator(_Generator):
+	'''Generates SDF documents using only tags from sdfparse.global_tag_list'''
+	def generate(self) -> str:
+		'''Returns a generated document'''
+		self.emit('[document]\n[head]\n')
+		for _ in range(self.rng.randint(1, 4)):
+			self.emit('[meta' + self.attrs(('author', 'language', 'title')) + '][/meta]\n')
+		self.emit('[/head]\n[body]\n')
+		while not self.full():
+			self.block(0)
+			self.emit('\n')
+		self.emit('[/body]\n[/document]\n')
+		return ''.join(self.out)
+
+	def block(self, depth: int):
+		'''Emits a random block-level construct'''
+		choice = self.rng.random()
+		if depth >= self.maxdepth or choice < 0.5 or self.full():
+			tag = self.rng.choice(_sdf_blocks)
+			self.emit(f'[{tag}]')
+			self.inline(depth + 1)
+			self.emit(f'[/{tag}]')
+		elif choice < 0.65:
+			self.emit('[ulist]\n')
+			for _ in range(self.rng.randint(1, self.tablesize)):
+				self.emit('[li]')
+				self.inline(depth + 1)
+				self.emit('[/li]\n')
+				if self.full():
+					break
+			self.emit('[/ulist]')
+		elif choice < 0.8:
+			self.emit('[table]\n[header]')
+			columns = self.rng.randint(1, self.tablesize)
+			for _ in range(columns):
+				self.emit('[cell]')
+				self.text()
+				self.emit('[/cell]')
+			self.emit('[/header]\n')
+			for _ in range(self.rng.randint(1, self.tablesize)):
+				self.emit('[row]')
+				for _ in range(columns):
+					self.emit(f'[cell color="#{self.rng.randrange(0x1000000):06X}"]')
+					self.text()
+					self.emit('[/cell]')
+				self.emit('[/row]\n')
+				if self.full():
+					break
+			self.emit('[/table]')
+		elif choice < 0.9:
+			self.emit('[align' + self.attrs(('type',)) + ']')
+			self.block(depth + 1)
+			self.emit('[/align]')
+		else:
+			self.emit('[code]')
+			self.text()
+			self.emit('[/code]')
+
+	def inline(self, depth: int):
+		'''Emits text with random nested inline formatting'''
+		for _ in range(self.rng.randint(1, 4)):
+			choice = self.rng.random()
+			if depth >= self.maxdepth or choice < 0.4 or self.full():
+				self.text()
+			elif choice < 0.8:
+				tag = self.rng.choice(_sdf_inline)
+				self.emit(f'[{tag}]')
+				self.inline(depth + 1)
+				self.emit(f'[/{tag}]')
+			elif choice < 0.9:
+				self.emit('[style' + self.attrs(('family', 'size', 'color', 'weight')) + ']')
+				self.inline(depth + 1)
+				self.emit('[/style]')
+			else:
+				self.emit(f'[link url="https://example.com/{self.rng.choice(_words)}?a=1&b=2"]')
+				self.text()
+				self.emit('[/link]')
+			self.emit(' ')
+
+
+def generate(kind: str, size: int, seed=0, maxdepth=8, textlen=40, tablesize=8) -> str:
+	'''Returns a random document of the given kind, 'antm' or 'sdf', of at least size characters.
+	The same arguments always produce the same document.'''
+	generator = AnTMGenerator if kind == 'antm' else SDFGenerator
+	return generator(size, seed, maxdepth, textlen, tablesize).generate()
+
+
+def handle_arguments() -> argparse.Namespace:
+	'''Parses the command-line arguments'''
+	parser = argparse.ArgumentParser(description='Generates random AnTM and SDF documents')
+	parser.add_argument('kind', type=str.casefold, choices=['antm', 'sdf'])
+	parser.add_argument('--size', type=int, default=65536, help='document size in characters')
+	parser.add_argument('--count', type=int, default=1,
+		help='number of documents. More than one are written as JSON Lines records.')
+	parser.add_argument('--seed', type=int, default=0, help='random seed of the first document')
+	parser.add_argument('--depth', type=int, default=8, help='maximum nesting depth')
+	parser.add_argument('--textlen', type=int, default=40, help='maximum words in a text run')
+	parser.add_argument('--tablesize', type=int, default=8,
+		help='maximum rows, columns, and list items')
+	return parser.parse_args()
+
+
+if __name__ == '__main__':
+	options = handle_arguments()
+	for i in range(options.count):
+		doc = generate(options.kind, options.size, options.seed + i, options.depth,
+			options.textlen, options.tablesize)
+		if options.count == 1:
+			sys.stdout.write(doc)
+		else:
+			sys.stdout.write(json.dumps({ 'id': i, 'body': doc }, ensure_ascii=False) + '\n')
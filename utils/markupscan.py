@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# markupscan - the bracketed-tag scanner shared by the AnTM and SDF parsers
+
+# Released under the terms of the MIT license
+# ©2020 Jon Yoder <jon@yoder.cloud>
+
+import re
+
+# Token kinds
+TEXT = 0
+TAG = 1
+
+# Both scanners split text into the same tokens. A tag is a '[' and the next ']' with no other
+# bracket between them. The value of a tag token is the text between the brackets. Everything
+# else is text. A text token never contains a '[' except as its first character, which only
+# happens when that bracket doesn't start a tag. Every token is yielded as a tuple of its kind,
+# its value, and its offset in the input.
+
+_token_pattern = re.compile(r'\[([^\[\]]*)\]|\[?[^\[]+|\[')
+
+def scan_regex(text: str):
+	'''Generator which scans text using a single compiled pattern'''
+	for match in _token_pattern.finditer(text):
+		inner = match.group(1)
+		if inner is None:
+			yield (TEXT, match.group(), match.start())
+		else:
+			yield (TAG, inner, match.start())
+
+
+def scan_statemachine(text: str):
+	'''Generator which scans text in a single pass with str.find(). The positions of the next
+	opening and closing brackets are remembered between tokens so no part of the input is searched
+	more than once.'''
+	length = len(text)
+	pos = 0
+	next_open = text.find('[')
+
+	# -2 means the next closing bracket hasn't been looked for yet. -1 means there are no more.
+	next_close = -2
+	while pos < length:
+		if next_open < 0:
+			yield (TEXT, text[pos:], pos)
+			return
+
+		if next_open > pos:
+			yield (TEXT, text[pos:next_open], pos)
+			pos = next_open
+
+		# pos is now at an opening bracket
+		next_open = text.find('[', pos + 1)
+		if next_close != -1 and next_close <= pos:
+			next_close = text.find(']', pos + 1)
+
+		if next_close >= 0 and (next_open < 0 or next_close < next_open):
+			yield (TAG, text[pos + 1:next_close], pos)
+			pos = next_close + 1
+			continue
+
+		# Not a tag, so the bracket starts a text token which runs to the next opening bracket
+		end = length if next_open < 0 else next_open
+		yield (TEXT, text[pos:end], pos)
+		pos = end
+
+
+# str.find() runs at memchr() speed and only the brackets are visited in Python code, which makes the
+# state machine the faster of the two in CPython. `markupbench.py scanners` compares them.
+scan = scan_statemachine
+
+def split_pending(text: str, maxtaglen: int) -> int:
+	'''For chunked input. Returns the offset of a trailing '[' which could be the start of a tag
+	continued in the next chunk or the length of the text if there isn't one. Brackets more than
+	maxtaglen characters from the end are not held back so that buffering stays bounded.'''
+	start = text.rfind('[', max(0, len(text) - maxtaglen))
+	if start < 0 or text.find(']', start) >= 0:
+		return len(text)
+	return start
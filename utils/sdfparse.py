@@ -5,7 +5,12 @@
 # Released under the terms of the MIT license
 # ©2019-2020 Jon Yoder <jon@yoder.cloud>
 
+import codecs
 import re
+import sys
+from types import MappingProxyType
+
+import markupscan
 
 global_tag_list = [
 	'align',
@@ -39,12 +44,20 @@ global_tag_list = [
 	'ulist'
 ]
 
+# Tag names are interned so that every Tag with the same name shares one string
+_tag_names = { name : sys.intern(name) for name in global_tag_list }
+
+# Most tokens have no attributes, so they all share this read-only empty mapping
+_empty_attributes = MappingProxyType(dict())
+
 class Tag:
 	'''Defines an SDF tag'''
-	def __init__(self):
-		self.name = ''
-		self.attributes = dict()
-		self.is_closing = False
+	__slots__ = ('name', 'attributes', 'is_closing')
+
+	def __init__(self, name='', attributes=_empty_attributes, is_closing=False):
+		self.name = name
+		self.attributes = attributes
+		self.is_closing = is_closing
 	
 	def __str__(self):
 		out = ['Tag(']
@@ -53,21 +66,35 @@ class Tag:
 		out.append(self.name)
 
 		if len(self.attributes) > 0:
-			out.extend([',',str(self.attributes)])
+			out.extend([',',str(dict(self.attributes))])
 		
 		out.append(')')
 		return ''.join(out)
 
+class SourceTag(Tag):
+	'''A Tag which also keeps the text between its brackets as it appeared in the document, so
+	that it can be reproduced exactly when rendered as text. Only tags which aren't written the
+	usual way are read as this class, so that the others don't pay for the extra slot.'''
+	__slots__ = ('source',)
+
+	def __init__(self, name='', attributes=_empty_attributes, is_closing=False, source=None):
+		super().__init__(name, attributes, is_closing)
+		self.source = source
+
 class TextRun:
 	'''Defines a run of formatted text with interaction like a dictionary'''
+	__slots__ = ('_attributes', 'text')
+
 	def __init__(self, text=''):
-		self._attributes = dict()
+		self._attributes = _empty_attributes
 		self.text = text
 	
 	def __contains__(self, key):
 		return key in self._attributes
 
 	def __delitem__(self, key):
+		if self._attributes is _empty_attributes:
+			raise KeyError(key)
 		del self._attributes[key]
 
 	def __getitem__(self, key):
@@ -77,76 +104,310 @@ class TextRun:
 		return self._attributes.__iter__()
 	
 	def __setitem__(self, key, value):
+		if self._attributes is _empty_attributes:
+			self._attributes = dict()
 		self._attributes[key] = value
 	
 	def __str__(self):
-		return str(self._attributes)
+		return str(dict(self._attributes))
 
 	def empty(self):
 		'''Empties the object of all values and clears any errors'''
-		self._attributes = dict()
+		self._attributes = _empty_attributes
 		return self
 
 	def count(self) -> int:
 		'''Returns the number of values contained by the return value'''
 		return len(self._attributes)
 
+# Matches the optional closing slash and the name at the start of a tag. The name must be the
+# whole first word so that text like `[i.e. foo]` or `[h1-x]` isn't taken for a tag.
+_tag_pattern = re.compile(r'(/?)([a-zA-Z0-9]+)(?=\s|$)')
+
+# Matches a name="value" attribute pair. The value may contain anything but a double quote.
+_attribute_pattern = re.compile(r'([a-zA-Z0-9]+)="([^"]*)"')
+
+
+def _lookup_tag(name: str) -> str:
+	'''Returns the shared copy of a tag name or None if it isn't a recognized tag'''
+	interned = _tag_names.get(name)
+	if interned is None:
+		interned = _tag_names.get(name.casefold())
+	return interned
+
+
 def parse_tag(tagstr: str) -> Tag:
 	'''Transforms string of a tag into a Tag object. The text is expected to be that which is in 
-	between the square brackets and stripped of whitespace'''
-	out = Tag()
+	between the square brackets and stripped of whitespace. None is returned if the string isn't a 
+	tag in global_tag_list so that the caller can render it as text.'''
 	
-	m = re.search(r'^(\/?)([a-zA-z0-9]+)', tagstr)
+	# Most tags have no attributes and can be handled with just a table lookup
+	name = _tag_names.get(tagstr)
+	if name is not None:
+		return Tag(name)
+	if tagstr[:1] == '/':
+		name = _tag_names.get(tagstr[1:])
+		if name is not None:
+			return Tag(name, is_closing=True)
+
+	m = _tag_pattern.match(tagstr)
 	if m is None:
 		return None
+
+	name = _lookup_tag(m.group(2))
+	if name is None:
+		return None
 	
-	if m[0][0] == '/':
-		out.is_closing = True
-		out.name = m[0][1:].casefold()
-		return out
-
-	out.name = m[0].casefold()
-
-	# Matches everything: ( [a-zA-Z]+=\"[^\"]*\")*
-	matches = re.findall(r'[a-zA-Z0-9]+=\"[^\"]*\"', tagstr)
-	for match in matches:
-		parts = match.split('=')
-		if len(parts) != 2:
-			continue
-		
-		try:
-			out.attributes[parts[0].strip().casefold()] = parts[1][1:-1]
-		except:
-			continue
+	# Closing tags have nothing but the name
+	if m.group(1):
+		return Tag(name, is_closing=True) if m.end() == len(tagstr) else None
 
+	out = Tag(name)
+	matches = _attribute_pattern.findall(tagstr, m.end())
+	if matches:
+		out.attributes = { key.casefold() : value for key, value in matches }
 	return out
 
 
+def _read_chunks(source, chunksize: int):
+	'''Normalizes the different kinds of input accepted by iter_tokens() into a series of str
+	chunks. Bytes are decoded as UTF-8 incrementally, so multibyte characters may be split across
+	chunks.'''
+	if isinstance(source, str):
+		yield source
+		return
+
+	decoder = codecs.getincrementaldecoder('utf-8')()
+	if isinstance(source, (bytes, bytearray)):
+		yield decoder.decode(source, final=True)
+		return
+
+	if hasattr(source, 'read'):
+		chunks = iter(lambda: source.read(chunksize), source.read(0))
+	else:
+		chunks = source
+
+	for chunk in chunks:
+		if isinstance(chunk, str):
+			yield chunk
+		else:
+			yield decoder.decode(chunk)
+	yield decoder.decode(b'', final=True)
+
+
+def iter_tokens(source, chunksize=65536, maxtaglen=4096):
+	'''Generator which tokenizes SDF data incrementally. source may be a string, bytes, a text or
+	binary file object, or any iterable of str or bytes chunks. Tags split across chunk boundaries
+	are handled, and text runs are yielded as soon as they are read, so a long run may arrive as
+	more than one str token. To keep memory use bounded, an opening bracket with no closing
+	bracket within maxtaglen characters is treated as text. A tag may not contain an opening
+	bracket.'''
+
+	pending = ''
+	for chunk in _read_chunks(source, chunksize):
+		buffer = pending + chunk if pending else chunk
+
+		# Hold back a possible tag which is split across chunks until more data arrives
+		cut = markupscan.split_pending(buffer, maxtaglen)
+		pending = buffer[cut:]
+		if cut < len(buffer):
+			buffer = buffer[:cut]
+
+		for kind, value, _ in markupscan.scan(buffer):
+			if kind == markupscan.TAG:
+				tag = parse_tag(value.strip())
+				if tag is not None:
+					# Only tags which aren't written the usual way keep their text
+					if value != _format_tag(tag):
+						tag = SourceTag(tag.name, tag.attributes, tag.is_closing, value)
+					yield tag
+					continue
+				value = '[' + value + ']'
+			yield value
+
+	# Anything left over is an unterminated tag, which is just text
+	if pending:
+		yield pending
+
+
 def tokenize(indata: str) -> list:
 	'''Takes in SFTM string data and spits out a list of tokens'''
-	rawtokens = re.findall(r'\[[^]]+\]|[^[]+', indata)
 
-	# We've split the raw text into tags and text runs, but there's more to it.
+	# We split the raw text into tags and text runs, but there's more to it.
 	#
 	# Tags not in the official list are rendered as text
 	# Tags inside [code] tags (except [/code]) are rendered as text
 	# Tags need to be parsed and turned into Tag objects
+	return list(iter_tokens(indata))
+
+
+def _format_tag(tag: Tag) -> str:
+	'''Returns the text between the brackets of a Tag written in the usual way'''
+	if not tag.attributes:
+		return '/' + tag.name if tag.is_closing else tag.name
+	
+	out = [ '/' if tag.is_closing else '', tag.name ]
+	for key, value in tag.attributes.items():
+		out.append(f' {key}="{value}"')
+	return ''.join(out)
+
+
+def _tag_text(tag: Tag) -> str:
+	'''Returns the markup for a Tag, used when a tag has to be rendered as text. Tags read from a
+	document are given back exactly as they were written.'''
+	source = getattr(tag, 'source', None)
+	if source is not None:
+		return '[' + source + ']'
+	return '[' + _format_tag(tag) + ']'
 
-	out = list()
 
-	for rawtoken in rawtokens:
-		if rawtoken == '':
-			continue
+class Node:
+	'''An element in an SDF document tree. Children are read from the token stream only when they
+	are asked for. iter_children() yields each child as soon as it has been read, so a caller which
+	stops early never pays for the rest of the document. Child nodes may still be incomplete when
+	they are yielded. Reading past a child completes that child, so it stays available
+	afterward. A text run is yielded once it has been read in full.'''
+	__slots__ = ('name', 'attributes', 'parent', '_children', '_text', '_complete', '_builder')
 
-		if rawtoken[0] == '[':
-			tag = parse_tag(rawtoken[1:-1].strip())
-			if tag is None:
-				out.append(rawtoken)
+	def __init__(self, name: str, attributes=_empty_attributes, parent=None, builder=None):
+		self.name = name
+		self.attributes = attributes
+		self.parent = parent
+		self._children = list()
+		self._complete = False
+		self._builder = builder
+
+		# The pieces of the text run being read, which may arrive in many tokens. They are
+		# joined once the run ends instead of as each arrives, which would take quadratic time.
+		self._text = None
+
+	def __str__(self):
+		return f"Node({self.name})"
+
+	@property
+	def children(self) -> list:
+		'''The complete list of child nodes and text runs. This builds the entire subtree.'''
+		while not self._complete and self._builder.step():
+			pass
+		return self._children
+
+	@property
+	def is_complete(self) -> bool:
+		'''True if the node's closing tag has been read'''
+		return self._complete
+
+	def iter_children(self):
+		'''Generator which yields child Nodes and text runs, reading only as much of the document
+		as is needed to produce each one'''
+		index = 0
+		while True:
+			if index < len(self._children):
+				yield self._children[index]
+				index += 1
+			elif self._complete or not self._builder.step():
+				return
+
+	def find(self, name: str):
+		'''Returns the first child Node with the given name or None if there isn't one'''
+		for child in self.iter_children():
+			if isinstance(child, Node) and child.name == name:
+				return child
+		return None
+
+	def _end_text(self):
+		'''Adds the text run being read, if any, to the children'''
+		if self._text is not None:
+			self._children.append(''.join(self._text))
+			self._text = None
+
+	def _finish(self):
+		self._end_text()
+		self._complete = True
+
+	def text(self) -> str:
+		'''Returns all text in the subtree with the markup removed'''
+		out = list()
+		for child in self.children:
+			if isinstance(child, Node):
+				out.append(child.text())
 			else:
-				out.append(tag)
+				out.append(child)
+		return ''.join(out)
+
+
+class Document(Node):
+	'''The root of an SDF document tree'''
+	__slots__ = ()
+
+	def _top(self) -> Node:
+		document = self.find('document')
+		return self if document is None else document
+
+	@property
+	def head(self) -> Node:
+		'''The [head] element or None. Only the tokens up to the end of the head are read.'''
+		return self._top().find('head')
+
+	@property
+	def body(self) -> Node:
+		'''The [body] element or None. Only the tokens up to the start of the body are built.'''
+		return self._top().find('body')
+
+
+class _TreeBuilder:
+	'''Reads tokens into a tree one at a time on behalf of the Nodes it creates'''
+	def __init__(self, tokens):
+		self.tokens = iter(tokens)
+		self.root = Document('', builder=self)
+		self.open_nodes = [ self.root ]
+
+	def step(self) -> bool:
+		'''Processes one token. Returns False once the token stream is exhausted.'''
+		token = next(self.tokens, None)
+		if token is None:
+			for node in self.open_nodes:
+				node._finish()
+			self.open_nodes = list()
+			return False
+
+		current = self.open_nodes[-1]
+		if isinstance(token, Tag):
+			# Tags inside [code] tags (except [/code]) are rendered as text
+			if current.name == 'code' and not (token.is_closing and token.name == 'code'):
+				self._add_text(current, _tag_text(token))
+			elif token.is_closing:
+				self._close(token)
+			else:
+				node = Node(token.name, token.attributes, current, self)
+				current._end_text()
+				current._children.append(node)
+				self.open_nodes.append(node)
 		else:
-			out.append(rawtoken)	
-	return out
+			self._add_text(current, token)
+		return True
+
+	def _add_text(self, node: Node, text: str):
+		if node._text is None:
+			node._text = [ text ]
+		else:
+			node._text.append(text)
+
+	def _close(self, tag: Tag):
+		# Closing a tag also closes any unclosed tags inside it. A closing tag which doesn't match
+		# anything open is rendered as text.
+		for i in range(len(self.open_nodes) - 1, 0, -1):
+			if self.open_nodes[i].name == tag.name:
+				for node in self.open_nodes[i:]:
+					node._finish()
+				del self.open_nodes[i:]
+				return
+		self._add_text(self.open_nodes[-1], _tag_text(tag))
+
+
+def build_tree(source, chunksize=65536) -> Document:
+	'''Returns a lazily-built document tree for SDF data. source may be anything accepted by
+	iter_tokens().'''
+	return _TreeBuilder(iter_tokens(source, chunksize)).root
 
 
 test1 = '''[document]
@@ -181,8 +442,27 @@ The problems which AnTM is intended to solve in replacing HTML for rich formatti
 [/document]
 '''
 
+def _print_tree(node: Node, depth=0):
+	'''Prints a document tree with one node or text run per line'''
+	for child in node.iter_children():
+		if isinstance(child, Node):
+			print('  ' * depth + str(child) + (str(dict(child.attributes)) if child.attributes else ''))
+			_print_tree(child, depth + 1)
+		elif child.strip():
+			print('  ' * depth + repr(child))
+
+
 if __name__ == '__main__':
-	tokens = tokenize(test1)
+	if len(sys.argv) > 1 and sys.argv[1] == '--tree':
+		_print_tree(build_tree(open(sys.argv[2], 'rb') if len(sys.argv) > 2 else test1))
+		sys.exit(0)
+
+	if len(sys.argv) > 1:
+		fhandle = open(sys.argv[1], 'rb')
+		tokens = iter_tokens(fhandle)
+	else:
+		tokens = iter_tokens(test1)
+
 	for token in tokens:
 		if isinstance(token, Tag):
 			print(token)
@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import antm2html
+
+def setup_test(name):
+	'''Creates a test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	test_folder = os.path.join(test_folder, name)
+	while os.path.exists(test_folder):
+		try:
+			shutil.rmtree(test_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(test_folder)
+	return test_folder
+
+
+def test_jsonl_bad_records():
+	'''Tests that records without a string in the AnTM field fail on their own instead of ending
+	the batch'''
+	test_folder = setup_test('test_jsonl_bad_records')
+
+	inpath = os.path.join(test_folder, 'in.jsonl')
+	outpath = os.path.join(test_folder, 'out.jsonl')
+	with open(inpath, 'w', encoding='utf-8') as fhandle:
+		for record in [ {'id':1, 'body':'[b]one[/b]'}, {'id':2, 'body':5}, {'id':3, 'body':None},
+				{'id':4}, {'id':5, 'body':'two'} ]:
+			fhandle.write(json.dumps(record) + '\n')
+		fhandle.write('5\n')
+
+	options = argparse.Namespace(inputs=[inpath], full=False, jsonl=True, field='body',
+		out=outpath, jobs=2, cache_size=1, cache_dir='', chunksize=2)
+	assert antm2html.run_batch(options) == 4, 'test_jsonl_bad_records: wrong failure count'
+
+	with open(outpath, 'r', encoding='utf-8') as fhandle:
+		records = [ json.loads(line) for line in fhandle ]
+	assert [ x['id'] for x in records ] == [1, 5], \
+		'test_jsonl_bad_records: good records missing from output'
+	assert all(x['html'] for x in records), 'test_jsonl_bad_records: record not converted'
+
+
+if __name__ == '__main__':
+	test_jsonl_bad_records()
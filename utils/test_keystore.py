@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import time
+
+import keystore
+
+def setup_test(name):
+	'''Creates a test folder hierarchy'''
+	test_folder = os.path.join(os.path.dirname(os.path.realpath(__file__)),'testfiles')
+	if not os.path.exists(test_folder):
+		os.mkdir(test_folder)
+
+	test_folder = os.path.join(test_folder, name)
+	while os.path.exists(test_folder):
+		try:
+			shutil.rmtree(test_folder)
+		except:
+			print("Waiting a second for test folder to unlock")
+			time.sleep(1.0)
+	os.mkdir(test_folder)
+	return test_folder
+
+
+def test_import_keys():
+	'''Tests importing encryption keypairs and refusing signing keypairs'''
+	test_folder = setup_test('test_import_keys')
+
+	encpairs = [ { 'PublicKey':f"CURVE25519:public{i}", 'PrivateKey':f"CURVE25519:private{i}" }
+		for i in range(3) ]
+	inpath = os.path.join(test_folder, 'keys.jsonl')
+	with open(inpath, 'w') as fhandle:
+		fhandle.writelines([ json.dumps(x) + '\n' for x in encpairs ])
+
+	with keystore.KeyStore(os.path.join(test_folder, 'keys.db')) as store:
+		assert keystore.import_keys(store, inpath) == 3, 'test_import_keys: wrong import count'
+		for item in encpairs:
+			assert store.find(keystore.keyhash(item['PublicKey'])) == item, \
+				'test_import_keys: keypair not found'
+
+		signpairs = [ encpairs[0], { 'VerificationKey':'ED25519:verify', 'SigningKey':'ED25519:sign' } ]
+		try:
+			store.add_many(signpairs)
+		except ValueError as e:
+			assert 'signing' in str(e), 'test_import_keys: unclear error for a signing keypair'
+		else:
+			assert False, 'test_import_keys: signing keypair accepted'
+
+		try:
+			store.add_many([ { 'PrivateKey':'CURVE25519:private' } ])
+		except ValueError:
+			pass
+		else:
+			assert False, 'test_import_keys: keypair without a public key accepted'
+		assert len(store) == 3, 'test_import_keys: failed import changed the store'
+
+
+if __name__ == '__main__':
+	test_import_keys()